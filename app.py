@@ -1,6 +1,8 @@
 #!/usr/bin/env python3
 
-from application import app
+from application import create_app
+
+app = create_app()
 
 if __name__=='__main__':
     app.run(debug=True, host='0.0.0.0')
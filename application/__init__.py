@@ -1,17 +1,87 @@
-from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
+from flask import Flask, request_finished
 import os
 from flask_bcrypt import Bcrypt
 from flask_login import LoginManager
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+import sqlite3
+from application.database import RoutingSQLAlchemy
 
-app = Flask(__name__)
+db = RoutingSQLAlchemy()
+bcrypt = Bcrypt()
+login_manager = LoginManager()
+login_manager.login_view = 'main.login'
 
-app.config['SQLALCHEMY_DATABASE_URI'] = str(os.getenv( 'FLASK_BOOK_URI' ))
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SECRET_KEY'] = str(os.getenv('MY_SECRET_KEY'))
-db = SQLAlchemy(app)
-bcrypt = Bcrypt(app)
-login_manager = LoginManager(app)
-login_manager.login_view = 'login'
+def _optional(name, cast):
+    value = os.getenv(name)
+    return None if value in (None, '') else cast(value)
 
-from application import routes
+def _flag(value):
+    return value.lower() in ('1', 'true', 'yes', 'on')
+
+def settings():
+    """The configuration taken from the environment."""
+    config = dict(
+        SQLALCHEMY_DATABASE_URI=str(os.getenv( 'FLASK_BOOK_URI' )),
+        SQLALCHEMY_TRACK_MODIFICATIONS=False,
+        SECRET_KEY=str(os.getenv('MY_SECRET_KEY')),
+        POOL_SIZE=_optional('FLASK_BOOK_POOL_SIZE', int),
+        POOL_MAX_OVERFLOW=_optional('FLASK_BOOK_POOL_MAX_OVERFLOW', int),
+        POOL_TIMEOUT=_optional('FLASK_BOOK_POOL_TIMEOUT', int),
+        POOL_RECYCLE=_optional('FLASK_BOOK_POOL_RECYCLE', int),
+        POOL_PRE_PING=_optional('FLASK_BOOK_POOL_PRE_PING', _flag),
+        CATALOGUE_PER_PAGE=int(os.getenv('CATALOGUE_PER_PAGE', 50)),
+        FRAGMENT_CACHE_SIZE=int(os.getenv('FRAGMENT_CACHE_SIZE', 20000)),
+        PAGE_CACHE_SIZE=int(os.getenv('PAGE_CACHE_SIZE', 1000)),
+        USER_CACHE_SIZE=int(os.getenv('USER_CACHE_SIZE', 10000)),
+        USER_CACHE_TTL=int(os.getenv('USER_CACHE_TTL', 300)),
+        BCRYPT_LOG_ROUNDS=int(os.getenv('BCRYPT_LOG_ROUNDS', 12)),
+        BCRYPT_POOL_SIZE=int(os.getenv('BCRYPT_POOL_SIZE', os.cpu_count() or 1)),
+        BCRYPT_QUEUE_SIZE=int(os.getenv('BCRYPT_QUEUE_SIZE', 32)),
+        BCRYPT_QUEUE_TIMEOUT=float(os.getenv('BCRYPT_QUEUE_TIMEOUT', 5)),
+        RECOMMEND_TOP_K=int(os.getenv('RECOMMEND_TOP_K', 20)),
+        RECOMMEND_PATH=_optional('FLASK_BOOK_RECOMMEND_PATH', str),
+        AUTOCOMPLETE_MAX=int(os.getenv('AUTOCOMPLETE_MAX', 50)),
+        SLOW_REQUEST_SECONDS=_optional('SLOW_REQUEST_SECONDS', float),
+        METRICS_DIR=_optional('FLASK_BOOK_METRICS_DIR', str),
+        WARM_RECOMMENDER=_flag(os.getenv('WARM_RECOMMENDER', 'no'))
+    )
+    if os.getenv('FLASK_BOOK_REPLICA_URI'):
+        config['SQLALCHEMY_BINDS'] = {'replica': os.getenv('FLASK_BOOK_REPLICA_URI')}
+    return config
+
+def create_app(config=None):
+    """Builds the app from the environment, with anything in config
+    taking priority. Read only views use the 'replica' entry of
+    SQLALCHEMY_BINDS when there is one."""
+    app = Flask(__name__)
+    app.config.update(settings())
+    app.config.update(config or {})
+    db.init_app(app)
+    bcrypt.init_app(app)
+    login_manager.init_app(app)
+
+    from application.cache import configure_caches
+    from application.passwords import hash_pool, pool_metrics
+    from application.recommend import configure_recommender
+    from application.autocomplete import configure_autocomplete
+    from application.metrics import init_metrics, add_collector
+    from application.conditional import keep_cookies_private
+    from application.routes import main
+    configure_caches(app.config)
+    hash_pool.configure(app.config)
+    configure_recommender(app.config)
+    configure_autocomplete(app.config)
+    init_metrics(app)
+    add_collector(pool_metrics)
+    request_finished.connect(keep_cookies_private, app)
+    app.register_blueprint(main)
+    return app
+
+@event.listens_for(Engine, 'connect')
+def sqlite_foreign_keys(connection, record):
+    """SQLite only honours ON DELETE CASCADE once foreign keys are on."""
+    if isinstance(connection, sqlite3.Connection):
+        cursor = connection.cursor()
+        cursor.execute('PRAGMA foreign_keys=ON')
+        cursor.close()
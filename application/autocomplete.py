@@ -0,0 +1,212 @@
+import heapq
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import Counter
+from application import db
+from application.models import Films
+from application.versions import get_version, film_changes_since
+
+# --- Title and director suggestions while typing ---
+
+FIELDS = ('title', 'director')
+ARTICLES = ('the ', 'a ', 'an ')
+
+# prefixes up to this long have their best suggestions worked out ahead,
+# they match too many names to rank on every keystroke
+SHORT = 3
+TOP_K = 10
+# how many suggestions are kept for each short prefix, the most a
+# request may ask for, see configure_autocomplete
+DEPTH = 50
+# longer prefixes rank at most this many names, in alphabetical order
+SCAN = 1000
+# seconds between checks of the 'films' version, rather than one query
+# per keystroke
+CHECK_EVERY = 1.0
+
+END = '\uffff'
+
+def keys(field, value):
+    """The lower case strings a value is found by: the whole value, a
+    title without its leading article and a directors last name."""
+    lowered = ' '.join(str(value).lower().split())
+    found = {lowered}
+    if field == 'title':
+        for article in ARTICLES:
+            if lowered.startswith(article):
+                found.add(lowered[len(article):])
+    elif ' ' in lowered:
+        found.add(lowered.rsplit(' ', 1)[1])
+    return found
+
+class PrefixIndex:
+    """For one field, a sorted list of (key, value) pairs searched with
+    bisect, how many films have each value, and the best depth values
+    for every prefix of up to SHORT letters."""
+
+    def __init__(self, field, depth=DEPTH):
+        self.field = field
+        self.depth = depth
+        self._keys = []
+        self._counts = Counter()
+        self._top = {}
+
+    def _ranked(self, values, k):
+        return heapq.nsmallest(k, values, key=lambda value: (-self._counts[value], value))
+
+    def _range(self, prefix, limit=None):
+        start = bisect_left(self._keys, (prefix,))
+        end = bisect_left(self._keys, (prefix + END,), start)
+        if limit is not None:
+            end = min(end, start + limit)
+        return {value for key, value in self._keys[start:end]}
+
+    def _prefixes(self, value):
+        return {key[:length] for key in keys(self.field, value) for length in range(1, min(SHORT, len(key)) + 1)}
+
+    def build(self, values):
+        self._counts = Counter(values)
+        self._keys = sorted((key, value) for value in self._counts for key in keys(self.field, value))
+        self._top = {}
+        groups = {}
+        for key, value in self._keys:
+            for length in range(1, min(SHORT, len(key)) + 1):
+                groups.setdefault(key[:length], set()).add(value)
+        for prefix, values in groups.items():
+            self._top[prefix] = self._ranked(values, self.depth)
+
+    def add(self, value):
+        self._counts[value] += 1
+        if self._counts[value] == 1:
+            for key in keys(self.field, value):
+                insort(self._keys, (key, value))
+        # only value has moved up, so it either joins the best or not
+        for prefix in self._prefixes(value):
+            self._top[prefix] = self._ranked(set(self._top.get(prefix, ())) | {value}, self.depth)
+
+    def discard(self, value):
+        if not self._counts[value]:
+            return
+        self._counts[value] -= 1
+        if not self._counts[value]:
+            del self._counts[value]
+            for key in keys(self.field, value):
+                position = bisect_left(self._keys, (key, value))
+                if position < len(self._keys) and self._keys[position] == (key, value):
+                    del self._keys[position]
+        # a value dropping out of the best is replaced from the full range
+        for prefix in self._prefixes(value):
+            if value in self._top.get(prefix, ()):
+                self._top[prefix] = self._ranked(self._range(prefix), self.depth)
+                if not self._top[prefix]:
+                    del self._top[prefix]
+
+    def complete(self, prefix, k=TOP_K):
+        """[(value, films with it), ...] best first."""
+        if len(prefix) <= SHORT and k <= self.depth:
+            values = self._top.get(prefix, [])[:k]
+        elif len(prefix) <= SHORT:
+            values = self._ranked(self._range(prefix), k)
+        else:
+            values = self._ranked(self._range(prefix, SCAN), k)
+        return [(value, self._counts[value]) for value in values]
+
+class AutocompleteIndex:
+    """A PrefixIndex per field, kept in step with the 'films' version the
+    same way as the search index. The version is read at most once every
+    CHECK_EVERY seconds so a keystroke never waits on the DATABASE."""
+
+    def __init__(self, depth=DEPTH):
+        self.depth = depth
+        self._lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._indexes = {field: PrefixIndex(field, self.depth) for field in FIELDS}
+            self._films = {}
+            self.built = False
+            self.version = None
+            self.checked = 0
+
+    def build(self, version=None):
+        with self._lock:
+            self._films = {
+                film.id: (film.title, film.director)
+                for film in db.session.query(Films.id, Films.title, Films.director).yield_per(1000)
+            }
+            for position, field in enumerate(FIELDS):
+                self._indexes[field].build(values[position] for values in self._films.values())
+            self.built = True
+            self.version = version
+            self.checked = time.time()
+
+    def _follows(self, version):
+        if self.built and self.version == version - 1:
+            self.version = version
+            return True
+        return False
+
+    def _unindex(self, filmID):
+        old = self._films.pop(filmID, None)
+        if old is not None:
+            for field, value in zip(FIELDS, old):
+                self._indexes[field].discard(value)
+
+    def add(self, film, version):
+        with self._lock:
+            if self._follows(version):
+                self._unindex(film.id)
+                self._films[film.id] = (film.title, film.director)
+                for field in FIELDS:
+                    self._indexes[field].add(getattr(film, field))
+
+    def remove(self, filmID, version):
+        with self._lock:
+            if self._follows(version):
+                self._unindex(int(filmID))
+
+    def catch_up(self, version):
+        """Re-reads only the films changed since the index, see
+        SearchIndex.catch_up."""
+        with self._lock:
+            if self.built and self.version is not None and self.version >= version:
+                return
+            changed = film_changes_since(self.version, version) if self.built else None
+            if changed is None:
+                self.build(version)
+                return
+            for filmID in changed:
+                self._unindex(filmID)
+            if changed:
+                for film in db.session.query(Films.id, Films.title, Films.director).filter(Films.id.in_(changed)):
+                    self._films[film.id] = (film.title, film.director)
+                    for field in FIELDS:
+                        self._indexes[field].add(getattr(film, field))
+            self.version = version
+
+    def _current(self):
+        if self.built and time.time() - self.checked < CHECK_EVERY:
+            return
+        self.catch_up(get_version('films'))
+        self.checked = time.time()
+
+    def complete(self, prefix, fields=FIELDS, k=TOP_K):
+        """The top k suggestions for prefix in each of fields, as
+        {field: [(value, films with it), ...]}."""
+        prefix = ' '.join(prefix.lower().split())
+        with self._lock:
+            self._current()
+            if not prefix:
+                return {field: [] for field in fields}
+            return {field: self._indexes[field].complete(prefix, k) for field in fields}
+
+autocomplete_index = AutocompleteIndex()
+
+def configure_autocomplete(config):
+    """Keeps as many suggestions per short prefix as a request may ask
+    for, before the index is first built."""
+    if autocomplete_index.depth != config['AUTOCOMPLETE_MAX']:
+        autocomplete_index.depth = config['AUTOCOMPLETE_MAX']
+        autocomplete_index.clear()
@@ -0,0 +1,38 @@
+import re
+from application import db
+from application.models import Films
+from application.ownership import chunks, update_collection
+
+# --- Adding films to a collection by their bar codes ---
+
+# Films.code is a 32 bit Integer column, larger codes cannot be stored
+MAX_CODE = 2 ** 31 - 1
+CODE = re.compile(r'^[0-9]+$')
+
+def parse_codes(text):
+    """Splits pasted or uploaded text on whitespace and commas. Returns
+    the bar codes found, in order without repeats, and anything that
+    is not a plain number small enough to be a code."""
+    codes, invalid, seen = [], [], set()
+    for token in re.split(r'[\s,;]+', text.strip()):
+        if not token:
+            continue
+        if not CODE.match(token) or int(token) > MAX_CODE:
+            invalid.append(token)
+            continue
+        code = int(token)
+        if code not in seen:
+            seen.add(code)
+            codes.append(code)
+    return codes, invalid
+
+def scan_into_collection(userID, codes):
+    """Adds every film matching codes to the users collection using one
+    lookup per chunk of codes and a single multi row insert, committed
+    together. Returns (added, already owned, unknown codes)."""
+    films = {}
+    for chunk in chunks(codes):
+        films.update(db.session.query(Films.code, Films.id).filter(Films.code.in_(chunk)))
+    delta = update_collection(userID, add=films.values())
+    unknown = [code for code in codes if code not in films]
+    return len(delta['added']), len(films) - len(delta['added']), unknown
@@ -0,0 +1,244 @@
+import json
+import os
+import random
+import re
+import threading
+import time
+from datetime import datetime
+from http.cookiejar import CookieJar
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+from urllib.request import Request, build_opener, HTTPCookieProcessor
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from werkzeug.serving import make_server, WSGIRequestHandler
+from application import db
+from application.models import Films, Users, Collection
+from application.synthetic import PASSWORD, EMAILS
+
+# --- Driving each route with concurrent clients and timing it ---
+
+ROUTE_HEADER = 'X-Bench-Route'
+CSRF = re.compile(rb'name="csrf_token" type="hidden" value="([^"]+)"')
+
+class QueryCounter:
+    """WSGI middleware counting the SQL statements run for each request
+    sent with a ROUTE_HEADER, grouped by that route."""
+
+    def __init__(self, app):
+        self.app = app
+        self.counts = {}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        event.listen(Engine, 'before_cursor_execute', self._count)
+
+    def _count(self, *args):
+        if getattr(self._local, 'queries', None) is not None:
+            self._local.queries += 1
+
+    def close(self):
+        event.remove(Engine, 'before_cursor_execute', self._count)
+
+    def __call__(self, environ, start_response):
+        route = environ.get('HTTP_' + ROUTE_HEADER.upper().replace('-', '_'))
+        if not route:
+            return self.app(environ, start_response)
+        self._local.queries = 0
+        response = self.app(environ, start_response)
+        try:
+            body = b''.join(response)
+        finally:
+            if hasattr(response, 'close'):
+                response.close()
+            with self._lock:
+                self.counts.setdefault(route, []).append(self._local.queries)
+            self._local.queries = None
+        return [body]
+
+class QuietHandler(WSGIRequestHandler):
+
+    def log_request(self, *args):
+        pass
+
+class Client:
+    """One browser, with its own cookies."""
+
+    def __init__(self, base):
+        self.base = base.rstrip('/')
+        self.opener = build_opener(HTTPCookieProcessor(CookieJar()))
+
+    def request(self, route, path, data=None):
+        """Returns (status, body) for path, sent as route."""
+        if data is not None:
+            data = urlencode(data).encode()
+        try:
+            response = self.opener.open(Request(self.base + path, data=data, headers={ROUTE_HEADER: route}))
+            return response.status, response.read()
+        except HTTPError as error:
+            return error.code, error.read()
+
+    def login(self, email, route='setup'):
+        status, page = self.request(route, '/login')
+        form = dict(email=email, password=PASSWORD)
+        token = CSRF.search(page)
+        if token:
+            form['csrf_token'] = token.group(1).decode()
+        return self.request(route, '/login', form)
+
+class Scenario:
+    """A route to time: path(rand) gives the page to ask for and login
+    says whether each client signs in first. Without a path the sign in
+    itself is timed, fetching the form and posting it. Redirects are
+    followed as a browser would and count towards the route."""
+
+    def __init__(self, name, path, login=True):
+        self.name = name
+        self.path = path
+        self.login = login
+
+def scenarios(filmIDs, genres):
+    return {
+        'catalogue': Scenario('catalogue',
+            lambda rand: '/catalogue' + (('?' + urlencode({'genre': rand.choice(genres)})) if genres and rand.random() < 0.5 else ''),
+            login=False),
+        'collection': Scenario('collection', lambda rand: '/collection'),
+        'login': Scenario('login', None, login=False),
+        'add_collection': Scenario('add_collection', lambda rand: '/catalogue/%d/add' % rand.choice(filmIDs))
+    }
+
+def percentile(values, share):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(round(share * (len(values) - 1))), len(values) - 1)]
+
+def _drive(scenario, base, emails, clients, requests, seed):
+    latencies, errors = [], []
+    lock = threading.Lock()
+
+    def work(number):
+        rand = random.Random(seed + number)
+        client = Client(base)
+        email = emails[number % len(emails)]
+        if scenario.login:
+            client.login(email)
+        mine = []
+        for _ in range(requests):
+            started = time.perf_counter()
+            if scenario.path is None:
+                status, body = Client(base).login(email, scenario.name)
+            else:
+                status, body = client.request(scenario.name, scenario.path(rand))
+            mine.append(time.perf_counter() - started)
+            if status >= 400:
+                with lock:
+                    errors.append(status)
+        with lock:
+            latencies.extend(mine)
+
+    threads = [threading.Thread(target=work, args=(number,)) for number in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+    return latencies, errors, wall
+
+def _summary(latencies, errors, wall, queries):
+    milliseconds = lambda value: None if value is None else round(value * 1000, 2)
+    return dict(
+        requests=len(latencies),
+        errors=len(errors),
+        throughput=round(len(latencies) / wall, 2) if wall else None,
+        p50=milliseconds(percentile(latencies, 0.50)),
+        p95=milliseconds(percentile(latencies, 0.95)),
+        p99=milliseconds(percentile(latencies, 0.99)),
+        queries=round(sum(queries) / len(queries), 2) if queries else None
+    )
+
+def dataset_size():
+    return dict(
+        films=db.session.query(Films).count(),
+        users=db.session.query(Users).count(),
+        collection=db.session.query(Collection).count()
+    )
+
+def run_benchmark(app, routes=None, clients=10, requests=50, url=None, seed=0):
+    """Times each route in routes with clients signed in users making
+    requests requests each, one route at a time. Without url the app is
+    served locally in this process, so the SQL run per request can be
+    counted too. Returns the results with the size of the data set."""
+    with app.app_context():
+        size = dataset_size()
+        emails = [email for email, in db.session.query(Users.email)
+            .filter(Users.email.like(EMAILS))
+            .order_by(Users.id).limit(max(clients, 1))]
+        filmIDs = [filmID for filmID, in db.session.query(Films.id).order_by(Films.id).limit(1000)]
+        genres = [genre for genre, in db.session.query(Films.genre).distinct().limit(20)]
+        db.session.remove()
+    if not emails:
+        raise ValueError('no benchmark users, run generate_data.py first')
+    available = scenarios(filmIDs, genres)
+    routes = routes or list(available)
+    counter = server = None
+    if url is None:
+        counter = QueryCounter(app.wsgi_app)
+        server = make_server('127.0.0.1', 0, counter, threaded=True, request_handler=QuietHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = 'http://127.0.0.1:%d' % server.server_port
+    results = {}
+    try:
+        for route in routes:
+            latencies, errors, wall = _drive(available[route], url, emails, clients, requests, seed)
+            queries = counter.counts.get(route, []) if counter else []
+            results[route] = _summary(latencies, errors, wall, queries)
+    finally:
+        if server:
+            server.shutdown()
+            server.server_close()
+            counter.close()
+    return dict(
+        started=datetime.utcnow().isoformat(timespec='seconds'),
+        url=None if counter else url,
+        clients=clients,
+        requests=requests,
+        dataset=size,
+        routes=results
+    )
+
+def save_results(results, folder):
+    """Stores a run as JSON named after the time it was made, the same
+    way test_results names its reports."""
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, datetime.now().strftime('bench-at-%b-%d-on-%y-%H:%M:%S.json'))
+    with open(path, 'w') as output:
+        json.dump(results, output, indent=2, sort_keys=True)
+    return path
+
+def latest_results(folder, skip=None):
+    """The most recent stored run in folder, apart from skip."""
+    if not os.path.isdir(folder):
+        return None
+    paths = [os.path.join(folder, name) for name in os.listdir(folder) if name.endswith('.json')]
+    paths = [path for path in paths if path != skip]
+    if not paths:
+        return None
+    with open(max(paths, key=os.path.getmtime)) as stored:
+        return json.load(stored)
+
+def compare(results, baseline):
+    """Lines showing how each route moved against an earlier run,
+    throughput up and latency down being better."""
+    lines = []
+    for route, now in sorted(results['routes'].items()):
+        before = baseline.get('routes', {}).get(route) if baseline else None
+        parts = []
+        for measure in ('throughput', 'p50', 'p95', 'p99', 'queries'):
+            value = now[measure]
+            if before and before.get(measure) and value is not None:
+                parts.append('%s %s (%+.1f%%)' % (measure, value, (value - before[measure]) * 100.0 / before[measure]))
+            else:
+                parts.append('%s %s' % (measure, value))
+        lines.append('%-15s %s' % (route, ', '.join(parts)))
+    return lines
@@ -0,0 +1,86 @@
+import threading
+import time
+from collections import OrderedDict
+from flask import render_template
+from markupsafe import Markup
+
+# --- Bounded in-process caches ---
+
+class LRUCache:
+    """A thread safe mapping holding at most maxsize entries, the least
+    recently used entry is dropped first when it is full. With ttl set
+    entries are also forgotten that many seconds after being set."""
+
+    instances = []
+
+    def __init__(self, maxsize, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        LRUCache.instances.append(self)
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            expires, value = self._data[key]
+            if expires is not None and expires < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        expires = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            return self._data.pop(key, (None, None))[1]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+def clear_caches():
+    for cache in LRUCache.instances:
+        cache.clear()
+
+# Keys start with the 'films' version, so a write to Films makes every
+# older entry unreachable and the LRU order clears them out over time.
+fragment_cache = LRUCache(20000)
+page_cache = LRUCache(1000)
+
+# Detached Users rows for the user_loader, see models.load_user.
+user_cache = LRUCache(10000, ttl=300)
+
+def configure_caches(config):
+    """Sizes the caches from the app config."""
+    fragment_cache.maxsize = config['FRAGMENT_CACHE_SIZE']
+    page_cache.maxsize = config['PAGE_CACHE_SIZE']
+    user_cache.maxsize = config['USER_CACHE_SIZE']
+    user_cache.ttl = config['USER_CACHE_TTL']
+
+def render_film(film, version, variant):
+    """The film_block.html markup for one film, rendered once per
+    catalogue version and variant ('anonymous' or 'user')."""
+    key = (version, variant, film.id)
+    fragment = fragment_cache.get(key)
+    if fragment is None:
+        fragment = Markup(render_template('film_block.html', film=film))
+        fragment_cache.set(key, fragment)
+    return fragment
@@ -0,0 +1,46 @@
+import hashlib
+from flask import request, make_response
+
+# --- ETag / Last-Modified validators for pages built from Versions ---
+
+def validators(versions, *extra):
+    """Builds a strong ETag from (value, updated) pairs returned by
+    get_versions plus anything else the page depends on, and picks the
+    latest update time for Last-Modified."""
+    parts = [str(value) for value, _ in versions] + [str(part) for part in extra]
+    etag = hashlib.sha1('|'.join(parts).encode('utf-8')).hexdigest()
+    times = [updated for _, updated in versions if updated is not None]
+    return etag, max(times) if times else None
+
+def is_fresh(etag, lastModified):
+    """True when the copy the client already has is still current. An
+    If-None-Match header takes priority over If-Modified-Since."""
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    since = request.if_modified_since
+    if since is not None and lastModified is not None:
+        return lastModified.replace(microsecond=0) <= since.replace(tzinfo=None)
+    return False
+
+def with_validators(response, etag, lastModified, private=False):
+    """Adds the validators to a response (or makes one from a view's
+    return value) and tells caches to check back before reusing it."""
+    response = make_response(response)
+    response.set_etag(etag)
+    if lastModified is not None:
+        response.last_modified = lastModified
+    response.headers['Cache-Control'] = 'private, no-cache' if private else 'public, no-cache'
+    response.vary.add('Cookie')
+    return response
+
+def not_modified(etag, lastModified, private=False):
+    return with_validators(make_response('', 304), etag, lastModified, private)
+
+def keep_cookies_private(sender, response, **extra):
+    """A response setting a cookie, such as a session refreshed from a
+    remember me cookie, must never be stored by a shared cache. Runs on
+    request_finished as the session cookie is only added after every
+    after_request function."""
+    cacheControl = response.headers.get('Cache-Control', '')
+    if 'Set-Cookie' in response.headers and 'public' in cacheControl:
+        response.headers['Cache-Control'] = cacheControl.replace('public', 'private')
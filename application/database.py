@@ -0,0 +1,58 @@
+from functools import wraps
+from flask import has_request_context, request
+from flask_sqlalchemy import SQLAlchemy, SignallingSession, get_state
+from sqlalchemy import orm
+
+# --- Connection pooling and read replica routing ---
+
+# config key -> create_engine option, unset keys keep the driver default
+POOL_OPTIONS = {
+    'POOL_SIZE': 'pool_size',
+    'POOL_MAX_OVERFLOW': 'max_overflow',
+    'POOL_TIMEOUT': 'pool_timeout',
+    'POOL_RECYCLE': 'pool_recycle',
+    'POOL_PRE_PING': 'pool_pre_ping'
+}
+
+# SQLite files get no queue pool, so these options would be refused
+QUEUE_ONLY_OPTIONS = ('pool_size', 'max_overflow', 'pool_timeout')
+
+REPLICA = 'replica'
+USE_REPLICA = 'flask_book.use_replica'
+
+def read_only(view):
+    """Marks a view as only reading, so its queries may go to the
+    'replica' bind when one is configured. The mark is kept on the
+    request itself so it also covers streamed responses."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        request.environ[USE_REPLICA] = True
+        return view(*args, **kwargs)
+    return wrapper
+
+class RoutingSession(SignallingSession):
+    """Sends reads made inside a read_only view to the replica. Anything
+    flushed, and everything outside such views, uses the primary."""
+
+    def get_bind(self, mapper=None, clause=None):
+        binds = self.app.config.get('SQLALCHEMY_BINDS') or {}
+        if REPLICA in binds and not self._flushing and has_request_context() and request.environ.get(USE_REPLICA):
+            return get_state(self.app).db.get_engine(self.app, bind=REPLICA)
+        return SignallingSession.get_bind(self, mapper, clause)
+
+class RoutingSQLAlchemy(SQLAlchemy):
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def apply_pool_defaults(self, app, options):
+        SQLAlchemy.apply_pool_defaults(self, app, options)
+        for key, option in POOL_OPTIONS.items():
+            if app.config.get(key) is not None:
+                options[option] = app.config[key]
+
+    def apply_driver_hacks(self, app, sa_url, options):
+        if sa_url.drivername.startswith('sqlite'):
+            for option in QUEUE_ONLY_OPTIONS:
+                options.pop(option, None)
+        SQLAlchemy.apply_driver_hacks(self, app, sa_url, options)
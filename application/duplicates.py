@@ -0,0 +1,186 @@
+import re
+import threading
+from collections import Counter
+from application import db
+from application.models import Films
+from application.versions import get_version, film_changes_since
+
+# --- Near duplicate films by trigrams of their title and director ---
+
+THRESHOLD = 0.6
+
+# how much the title and the director count towards the similarity
+TITLE_WEIGHT = 0.75
+
+# words that tell copies of the same film apart rather than the film
+NOISE = {
+    'the', 'a', 'an', 'dvd', 'bluray', 'blu', 'ray', '4k', 'uhd', 'hd', 'vhs', 'digital',
+    'edition', 'special', 'collectors', 'remastered', 'widescreen', 'cut', 'directors'
+}
+
+# trigrams found in more films than this are left out when looking for
+# candidates, they match too much to narrow anything down
+COMMON = 2000
+CANDIDATES = 50
+
+WORD = re.compile(r'[a-z0-9]+')
+NUMBER = re.compile(r'^([0-9]+|[ivx]+)$')
+
+def normalise(text):
+    """Lower case words without punctuation or NOISE, so 'Matrix, The'
+    and 'The Matrix (Blu-ray)' both become 'matrix'."""
+    return ' '.join(word for word in WORD.findall(str(text).lower()) if word not in NOISE)
+
+def trigrams(title, director):
+    """The set of three letter pieces of the title and, marked apart,
+    of the director."""
+    grams = set()
+    for mark, text in (('t', title), ('d', director)):
+        padded = '  %s ' % normalise(text)
+        grams.update(mark + padded[start:start + 3] for start in range(len(padded) - 2))
+    return grams
+
+def numbers(title):
+    """The numbers in a title, digits or roman, which set sequels apart."""
+    return {word for word in normalise(title).split() if NUMBER.match(word)}
+
+def _jaccard(first, second):
+    if not first or not second:
+        return 0.0
+    shared = len(first & second)
+    return shared / (len(first) + len(second) - shared)
+
+def similarity(first, second):
+    """Jaccard similarity of the title trigrams and of the director
+    trigrams of two films, weighted by TITLE_WEIGHT."""
+    titles = _jaccard({gram for gram in first if gram[0] == 't'}, {gram for gram in second if gram[0] == 't'})
+    directors = _jaccard({gram for gram in first if gram[0] == 'd'}, {gram for gram in second if gram[0] == 'd'})
+    return TITLE_WEIGHT * titles + (1 - TITLE_WEIGHT) * directors
+
+class DuplicateIndex:
+    """Maps each trigram to the films containing it and keeps the title
+    and director of each film. Kept in step with the 'films' version the
+    same way as the search index."""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._postings = {}
+            self._films = {}
+            self.built = False
+            self.version = None
+
+    def _index(self, film):
+        grams = trigrams(film.title, film.director)
+        self._films[film.id] = (film.title, film.director)
+        for gram in grams:
+            self._postings.setdefault(gram, set()).add(film.id)
+
+    def _unindex(self, filmID):
+        found = self._films.pop(filmID, None)
+        if found is None:
+            return
+        for gram in trigrams(*found):
+            films = self._postings.get(gram)
+            if films is not None:
+                films.discard(filmID)
+                if not films:
+                    del self._postings[gram]
+
+    def build(self, version=None):
+        with self._lock:
+            self._postings = {}
+            self._films = {}
+            for film in db.session.query(Films.id, Films.title, Films.director).yield_per(1000):
+                self._index(film)
+            self.built = True
+            self.version = version
+
+    def _follows(self, version):
+        if self.built and self.version == version - 1:
+            self.version = version
+            return True
+        return False
+
+    def add(self, film, version):
+        with self._lock:
+            if self._follows(version):
+                self._unindex(film.id)
+                self._index(film)
+
+    def remove(self, filmID, version):
+        with self._lock:
+            if self._follows(version):
+                self._unindex(int(filmID))
+
+    def catch_up(self, version):
+        """Re-reads only the films changed since the index, see
+        SearchIndex.catch_up."""
+        with self._lock:
+            if self.built and self.version is not None and self.version >= version:
+                return
+            changed = film_changes_since(self.version, version) if self.built else None
+            if changed is None:
+                self.build(version)
+                return
+            for filmID in changed:
+                self._unindex(filmID)
+            if changed:
+                for film in db.session.query(Films.id, Films.title, Films.director).filter(Films.id.in_(changed)):
+                    self._index(film)
+            self.version = version
+
+    def _current(self):
+        self.catch_up(get_version('films'))
+
+    def _similar(self, title, director, exclude, threshold):
+        grams = trigrams(title, director)
+        sequel = numbers(title)
+        counts = Counter()
+        for gram in grams:
+            films = self._postings.get(gram, ())
+            if len(films) <= COMMON:
+                counts.update(films)
+        found = []
+        for filmID, _ in counts.most_common(CANDIDATES):
+            otherTitle, otherDirector = self._films[filmID]
+            if filmID == exclude or numbers(otherTitle) != sequel:
+                continue
+            score = similarity(grams, trigrams(otherTitle, otherDirector))
+            if score >= threshold:
+                found.append((filmID, score))
+        return sorted(found, key=lambda pair: (-pair[1], pair[0]))
+
+    def similar(self, title, director, exclude=None, threshold=THRESHOLD, limit=5):
+        """Films that look like the same film as title by director, most
+        alike first, as (film id, similarity) pairs."""
+        with self._lock:
+            self._current()
+            return self._similar(title, director, exclude, threshold)[:limit]
+
+    def clusters(self, threshold=THRESHOLD):
+        """Groups of two or more films joined by near duplicate pairs,
+        each sorted by id, for cleaning up the catalogue."""
+        with self._lock:
+            self._current()
+            parent = {}
+
+            def root(filmID):
+                while parent.get(filmID, filmID) != filmID:
+                    filmID = parent[filmID]
+                return filmID
+
+            for filmID, (title, director) in self._films.items():
+                for other, score in self._similar(title, director, filmID, threshold):
+                    first, second = root(filmID), root(other)
+                    if first != second:
+                        parent[max(first, second)] = min(first, second)
+            groups = {}
+            for filmID in parent:
+                groups.setdefault(root(filmID), {root(filmID)}).add(filmID)
+        return sorted(sorted(group) for group in groups.values())
+
+duplicate_index = DuplicateIndex()
@@ -0,0 +1,55 @@
+import csv
+import json
+from flask import Response, stream_with_context
+from application import db
+from application.models import Films, Collection, FILM_FIELDS
+
+# --- Streaming CSV/JSONL exports, readable by import_films.py ---
+
+ROWS_PER_CHUNK = 500
+
+MIMETYPES = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson'
+}
+
+class _Echo:
+    """Lets csv.writer hand back each line instead of writing it."""
+    def write(self, value):
+        return value
+
+def films_query(userID=None):
+    """The film columns in id order, read through a server side cursor a
+    batch at a time. With userID only the films in that users collection."""
+    query = db.session.query(*[getattr(Films, field) for field in FILM_FIELDS])
+    if userID is not None:
+        query = query.join(Collection, Collection.films_id == Films.id).filter(Collection.user_id == userID)
+    return query.order_by(Films.id).execution_options(stream_results=True).yield_per(ROWS_PER_CHUNK)
+
+def _lines(rows, fmt):
+    if fmt == 'csv':
+        writer = csv.writer(_Echo())
+        yield writer.writerow(FILM_FIELDS)
+        for row in rows:
+            yield writer.writerow(row)
+    else:
+        for row in rows:
+            yield json.dumps(dict(zip(FILM_FIELDS, row))) + '\n'
+
+def _chunked(lines):
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) >= ROWS_PER_CHUNK:
+            yield ''.join(chunk)
+            chunk = []
+    if chunk:
+        yield ''.join(chunk)
+
+def export_response(query, fmt, filename):
+    """A response that sends the rows as they are read, so the first
+    bytes go out straight away and the full result is never in memory."""
+    body = stream_with_context(_chunked(_lines(query, fmt)))
+    response = Response(body, mimetype=MIMETYPES[fmt])
+    response.headers['Content-Disposition'] = 'attachment; filename=%s.%s' % (filename, fmt)
+    return response
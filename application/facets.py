@@ -0,0 +1,80 @@
+from collections import Counter
+from sqlalchemy import false, func
+from application import db
+from application.models import Films, FacetCounts
+from application.versions import bump_version
+
+# --- Film counts per genre, year, format and age rating ---
+
+FACETS = ('genre', 'year', 'formating', 'age')
+
+def film_facets(film):
+    """The (facet, value) pairs a film, or a dict of its columns, is
+    counted under."""
+    if isinstance(film, dict):
+        return [(facet, str(film[facet])) for facet in FACETS]
+    return [(facet, str(getattr(film, facet))) for facet in FACETS]
+
+def adjust_facets(added=(), removed=()):
+    """Moves the stored counts by the facet pairs of films added and
+    removed, as part of the current transaction. Pairs in both cancel
+    out, so an edit only touches the facets that changed."""
+    changes = Counter(added)
+    changes.subtract(Counter(removed))
+    table = FacetCounts.__table__
+    for (facet, value), change in changes.items():
+        if not change:
+            continue
+        updated = db.session.execute(
+            table.update()
+                .where(table.c.facet == facet)
+                .where(table.c.value == value)
+                .values(count=table.c.count + change)
+        ).rowcount
+        if not updated and change > 0:
+            db.session.execute(table.insert().values(facet=facet, value=value, count=change))
+    if any(change < 0 for change in changes.values()):
+        db.session.execute(table.delete().where(table.c.count <= 0))
+
+def rebuild_facets():
+    """Recounts every facet from the Films table, for repairs. The films
+    version is bumped so cached catalogue pages pick up the new counts."""
+    table = FacetCounts.__table__
+    db.session.execute(table.delete())
+    for facet in FACETS:
+        column = getattr(Films, facet)
+        rows = db.session.query(column, func.count(Films.id)).group_by(column)
+        counts = [dict(facet=facet, value=str(value), count=count) for value, count in rows]
+        if counts:
+            db.session.execute(table.insert(), counts)
+    bump_version('films')
+    db.session.commit()
+
+def facet_counts():
+    """{facet: [(value, count), ...]} with the largest counts first."""
+    counts = {facet: [] for facet in FACETS}
+    rows = db.session.query(FacetCounts.facet, FacetCounts.value, FacetCounts.count) \
+        .order_by(FacetCounts.count.desc(), FacetCounts.value)
+    for facet, value, count in rows:
+        if facet in counts:
+            counts[facet].append((value, count))
+    return counts
+
+def facet_filters(args):
+    """The facet filters given in the query string."""
+    filters = {}
+    for facet in FACETS:
+        value = args.get(facet)
+        if value:
+            filters[facet] = value
+    return filters
+
+def apply_filters(query, filters):
+    for facet, value in filters.items():
+        if facet == 'year':
+            try:
+                value = int(value)
+            except ValueError:
+                return query.filter(false())
+        query = query.filter(getattr(Films, facet) == value)
+    return query
@@ -1,7 +1,9 @@
 from flask_wtf import FlaskForm
-from wtforms import IntegerField, StringField, SubmitField, PasswordField, BooleanField
+from flask_wtf.file import FileField
+from wtforms import IntegerField, StringField, SubmitField, PasswordField, BooleanField, TextAreaField
 from wtforms.validators import DataRequired, Length, Email, EqualTo, ValidationError
 from application.models import Users, Films
+from application.duplicates import duplicate_index
 from flask_login import current_user
 
 class FilmsForm(FlaskForm):
@@ -60,8 +62,37 @@ class FilmsForm(FlaskForm):
             ]
     )
 
+    confirm = BooleanField("This is not one of the films above, save it anyway")
+
     submit = SubmitField('Add!')
 
+    # set False to skip the near duplicate check, film_id is the film
+    # being edited so it does not match itself
+    check_duplicates = True
+    film_id = None
+    duplicates = ()
+
+    def validate_confirm(self, confirm):
+        if confirm.data or not self.check_duplicates or not self.title.data or not self.director.data:
+            return
+        matches = duplicate_index.similar(self.title.data, self.director.data, exclude=self.film_id)
+        if matches:
+            found = {film.id: film for film in Films.query.filter(Films.id.in_([filmID for filmID, score in matches]))}
+            self.duplicates = [found[filmID] for filmID, score in matches if filmID in found]
+            raise ValidationError('This looks like a film already in the catalogue.')
+
+class ScanForm(FlaskForm):
+
+    codes = TextAreaField("Bar Codes")
+
+    upload = FileField("Or upload a list of Bar Codes")
+
+    submit = SubmitField('Add to my collection!')
+
+    def validate_codes(self, codes):
+        if not codes.data and not self.upload.data:
+            raise ValidationError('Paste some bar codes or upload a file')
+
 #-----------------------------------------------------------------------------------------------
 #--- USERS -------------------------------------------------------------------------------------
 #-----------------------------------------------------------------------------------------------
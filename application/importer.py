@@ -0,0 +1,186 @@
+import csv
+import json
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from sqlalchemy import Integer, bindparam
+from flask import current_app
+from werkzeug.datastructures import MultiDict
+from application import create_app, db
+from application.models import Films, FILM_FIELDS, hash_description
+from application.forms import FilmsForm
+from application.barcodes import MAX_CODE
+from application.versions import bump_films, MAX_CHANGES
+from application.facets import film_facets, adjust_facets
+from application.stats import film_stats, invalidate_stats
+
+# --- Streaming bulk import of films from CSV or JSONL files ---
+
+def read_rows(path, fmt=None):
+    """Yields (line number, row) pairs one at a time so the file is never
+    held in memory. The format is taken from the extension unless given."""
+    fmt = fmt or ('jsonl' if path.endswith(('.jsonl', '.json')) else 'csv')
+    with open(path, newline='', encoding='utf-8') as source:
+        if fmt == 'csv':
+            reader = csv.DictReader(source)
+            for row in reader:
+                yield reader.line_num, row
+        else:
+            for lineNo, line in enumerate(source, start=1):
+                if line.strip():
+                    try:
+                        yield lineNo, json.loads(line)
+                    except ValueError as error:
+                        yield lineNo, {'_error': str(error)}
+
+def batches(rows, size):
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+# the app used by validate_batch inside pool processes
+_worker_app = None
+
+def _start_worker():
+    global _worker_app
+    _worker_app = create_app()
+
+def _column_errors(row):
+    """Values the form lets through that the Films columns cannot hold,
+    a longer genre say. One of them would fail the whole executemany of
+    its batch on a strict MySQL server."""
+    errors = {}
+    for field, value in row.items():
+        columnType = Films.__table__.c[field].type
+        length = getattr(columnType, 'length', None)
+        if length and len(value) > length:
+            errors[field] = ['Field cannot be longer than %d characters.' % length]
+        elif isinstance(columnType, Integer) and not -MAX_CODE - 1 <= value <= MAX_CODE:
+            errors[field] = ['Number must be between %d and %d.' % (-MAX_CODE - 1, MAX_CODE)]
+    return errors
+
+def validate_batch(batch):
+    """Checks each row against the same rules as the FilmsForm on the
+    'add_movie' page and against the sizes of the Films columns. Returns
+    the cleaned rows and the errors by line."""
+    valid, errors = [], []
+    app = _worker_app or current_app._get_current_object()
+    with app.test_request_context():
+        for lineNo, row in batch:
+            if '_error' in row:
+                errors.append((lineNo, {'row': [row['_error']]}))
+                continue
+            formdata = MultiDict(
+                (field, str(row[field])) for field in FILM_FIELDS if row.get(field) is not None
+            )
+            form = FilmsForm(formdata=formdata, meta={'csrf': False})
+            form.check_duplicates = False
+            if not form.validate():
+                errors.append((lineNo, form.errors))
+                continue
+            cleaned = {field: form[field].data for field in FILM_FIELDS}
+            tooBig = _column_errors(cleaned)
+            if tooBig:
+                errors.append((lineNo, tooBig))
+            else:
+                valid.append((lineNo, cleaned))
+    return valid, errors
+
+def _existing(column, values):
+    if not values:
+        return {}
+    return dict(db.session.query(column, Films.code).filter(column.in_(values)))
+
+def write_batch(rows, update=False):
+    """Inserts a batch of validated rows with one executemany. Rows whose
+    code or description is already taken are skipped, or when update is
+    set, rows with a known code overwrite that film. Returns counts and
+    the skipped rows as (line number, reason)."""
+    rows = [(lineNo, dict(row, description_hash=hash_description(row['description']))) for lineNo, row in rows]
+    codes = _existing(Films.code, [row['code'] for _, row in rows])
+    descriptions = _existing(Films.description_hash, [row['description_hash'] for _, row in rows])
+    inserts, updates, skipped = [], [], []
+    seenCodes, seenDescriptions = set(), set()
+    for lineNo, row in rows:
+        code, description = row['code'], row['description_hash']
+        if code in seenCodes or description in seenDescriptions:
+            skipped.append((lineNo, 'duplicate within file'))
+            continue
+        seenCodes.add(code)
+        seenDescriptions.add(description)
+        takenBy = descriptions.get(description)
+        if takenBy is not None and takenBy != code:
+            skipped.append((lineNo, 'description already used by code %s' % takenBy))
+        elif code in codes:
+            if update:
+                updates.append(dict(row, b_code=code))
+            else:
+                skipped.append((lineNo, 'code already in catalogue'))
+        else:
+            inserts.append(row)
+    added = [pair for row in inserts + updates for pair in film_facets(row)]
+    removed = []
+    if updates:
+        replaced = db.session.query(Films).filter(Films.code.in_([row['code'] for row in updates])).all()
+        removed = [pair for film in replaced for pair in film_facets(film)]
+        newRows = {row['code']: row for row in updates}
+        invalidate_stats([film.id for film in replaced if film_stats(newRows[film.code]) != film_stats(film)])
+    if inserts:
+        db.session.execute(Films.__table__.insert(), inserts)
+    if updates:
+        db.session.execute(
+            Films.__table__.update()
+                .where(Films.code == bindparam('b_code'))
+                .values({field: bindparam(field) for field in FILM_FIELDS + ('description_hash',) if field != 'code'}),
+            updates
+        )
+    if inserts or updates:
+        adjust_facets(added=added, removed=removed)
+        changed = None
+        if len(inserts) + len(updates) <= MAX_CHANGES:
+            changed = [filmID for filmID, in db.session.query(Films.id).filter(
+                Films.code.in_([row['code'] for row in inserts + updates])
+            )]
+        bump_films(changed)
+    db.session.commit()
+    return len(inserts), len(updates), skipped
+
+def _validated(chunks, workers):
+    """Runs validate_batch over the chunks, on a process pool when
+    workers is set. Results come back in file order and only a few
+    chunks are ever in flight, keeping memory flat."""
+    if not workers:
+        for chunk in chunks:
+            yield validate_batch(chunk)
+        return
+    with ProcessPoolExecutor(max_workers=workers, initializer=_start_worker) as pool:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.submit(validate_batch, chunk))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def import_films(path, fmt=None, batch_size=1000, workers=None, update=False, report=sys.stderr):
+    """Imports every film in path. Problems with single rows are written to
+    report and do not stop the import. Returns a dict of totals."""
+    totals = dict(inserted=0, updated=0, skipped=0, invalid=0)
+    chunks = batches(read_rows(path, fmt), batch_size)
+    for valid, errors in _validated(chunks, workers):
+        for lineNo, fieldErrors in errors:
+            for field, messages in fieldErrors.items():
+                report.write('line %s: %s: %s\n' % (lineNo, field, ' '.join(messages)))
+        totals['invalid'] += len(errors)
+        if valid:
+            inserted, updated, skipped = write_batch(valid, update=update)
+            for lineNo, reason in skipped:
+                report.write('line %s: skipped, %s\n' % (lineNo, reason))
+            totals['inserted'] += inserted
+            totals['updated'] += updated
+            totals['skipped'] += len(skipped)
+    return totals
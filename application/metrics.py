@@ -0,0 +1,316 @@
+import json
+import os
+import threading
+import time
+import uuid
+from flask import request, before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# --- Per endpoint timings exposed in the Prometheus text format ---
+
+SECONDS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERIES = (1, 2, 5, 10, 20, 50, 100, 200)
+BYTES = (1000, 10000, 100000, 1000000, 10000000)
+
+ENDPOINT = 'flask_book.endpoint'
+SLOW_QUERIES_SHOWN = 50
+
+# seconds between writes of this process's figures to the shared directory
+FLUSH_EVERY = 1.0
+
+class Histogram:
+    """Counts observations into cumulative buckets for each endpoint."""
+
+    def __init__(self, name, help, buckets):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, endpoint, value):
+        with self._lock:
+            series = self._series.get(endpoint)
+            if series is None:
+                series = self._series[endpoint] = [[0] * len(self.buckets), 0, 0]
+            for position, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][position] += 1
+            series[1] += value
+            series[2] += 1
+
+    def count(self, endpoint):
+        series = self._series.get(endpoint)
+        return series[2] if series else 0
+
+    def clear(self):
+        with self._lock:
+            self._series = {}
+
+    def snapshot(self):
+        """A copy of every series, {endpoint: [buckets, sum, count]}."""
+        with self._lock:
+            return {endpoint: [list(buckets), total, count] for endpoint, (buckets, total, count) in self._series.items()}
+
+    def render(self, series=None):
+        """The histogram in the Prometheus text format, from series merged
+        across processes when given, otherwise from this process."""
+        lines = ['# HELP %s %s' % (self.name, self.help), '# TYPE %s histogram' % self.name]
+        if series is None:
+            series = self.snapshot()
+        for endpoint, (buckets, total, count) in sorted(series.items()):
+            for bound, inBucket in zip(self.buckets, buckets):
+                lines.append('%s_bucket{endpoint="%s",le="%s"} %d' % (self.name, endpoint, bound, inBucket))
+            lines.append('%s_bucket{endpoint="%s",le="+Inf"} %d' % (self.name, endpoint, count))
+            lines.append('%s_sum{endpoint="%s"} %s' % (self.name, endpoint, repr(float(total))))
+            lines.append('%s_count{endpoint="%s"} %d' % (self.name, endpoint, count))
+        return lines
+
+request_seconds = Histogram('flask_book_request_seconds', 'Time from the request arriving to the last byte sent.', SECONDS)
+request_queries = Histogram('flask_book_request_queries', 'SQL statements run per request.', QUERIES)
+query_seconds = Histogram('flask_book_query_seconds', 'Time spent running SQL per request.', SECONDS)
+template_seconds = Histogram('flask_book_template_seconds', 'Time spent rendering templates per request.', SECONDS)
+response_bytes = Histogram('flask_book_response_bytes', 'Size of the response body.', BYTES)
+HISTOGRAMS = (request_seconds, request_queries, query_seconds, template_seconds, response_bytes)
+
+_current = threading.local()
+
+# functions giving ([(name, value), ...] counters, [(name, value), ...]
+# gauges) for figures kept outside the histograms, see add_collector
+COLLECTORS = []
+
+def add_collector(function):
+    if function not in COLLECTORS:
+        COLLECTORS.append(function)
+
+def _collected():
+    counters, gauges = {}, {}
+    for function in COLLECTORS:
+        found = function()
+        counters.update(found[0])
+        gauges.update(found[1])
+    return counters, gauges
+
+class MetricsStore:
+    """Shares the figures of every gunicorn worker through a directory.
+    Each process writes its own file at most every FLUSH_EVERY seconds,
+    and the worker answering a scrape adds up all of them, so counts do
+    not jump about with whichever worker is asked. Files of workers that
+    have exited are kept, their counts must not go backwards, but their
+    gauges are dropped by mark_process_dead. Without a directory only
+    this process is reported."""
+
+    def __init__(self, directory=None):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._pid = None
+        self._name = None
+        self._flushed = 0
+
+    def _path(self):
+        # a forked worker must not write over its parents file
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._name = '%d-%s.json' % (self._pid, uuid.uuid4().hex)
+            self._flushed = 0
+        return os.path.join(self.directory, self._name)
+
+    def flush(self):
+        """Writes this process's figures to its file in one rename, so a
+        reader never sees half a file."""
+        if not self.directory:
+            return
+        counters, gauges = _collected()
+        figures = dict(
+            pid=os.getpid(),
+            histograms={histogram.name: histogram.snapshot() for histogram in HISTOGRAMS},
+            counters=counters,
+            gauges=gauges
+        )
+        with self._lock:
+            path = self._path()
+            with open(path + '.tmp', 'w') as saved:
+                json.dump(figures, saved)
+            os.replace(path + '.tmp', path)
+            self._flushed = time.monotonic()
+
+    def flush_if_due(self):
+        if self.directory and time.monotonic() - self._flushed >= FLUSH_EVERY:
+            self.flush()
+
+    def remove(self):
+        """Forgets this process's file, after clear_metrics."""
+        if self.directory and self._pid == os.getpid():
+            with self._lock:
+                if os.path.exists(self._path()):
+                    os.remove(self._path())
+
+    def _files(self):
+        for name in sorted(os.listdir(self.directory)):
+            if name.endswith('.json'):
+                try:
+                    with open(os.path.join(self.directory, name)) as saved:
+                        yield json.load(saved)
+                except (OSError, ValueError):
+                    continue
+
+    def collect(self):
+        """({histogram name: series}, counters, gauges) added up across
+        every process, or for this process alone without a directory."""
+        if not self.directory:
+            counters, gauges = _collected()
+            return {histogram.name: histogram.snapshot() for histogram in HISTOGRAMS}, counters, gauges
+        self.flush()
+        histograms = {histogram.name: {} for histogram in HISTOGRAMS}
+        counters, gauges = {}, {}
+        for figures in self._files():
+            for name, series in figures['histograms'].items():
+                merged = histograms.setdefault(name, {})
+                for endpoint, (buckets, total, count) in series.items():
+                    found = merged.setdefault(endpoint, [[0] * len(buckets), 0, 0])
+                    found[0] = [mine + theirs for mine, theirs in zip(found[0], buckets)]
+                    found[1] += total
+                    found[2] += count
+            for name, value in figures['counters'].items():
+                counters[name] = counters.get(name, 0) + value
+            for name, value in figures['gauges'].items():
+                gauges[name] = gauges.get(name, 0) + value
+        return histograms, counters, gauges
+
+    def mark_process_dead(self, pid):
+        """Drops the gauges of a worker that has exited, its counts stay."""
+        if not self.directory:
+            return
+        for name in os.listdir(self.directory):
+            if name.startswith('%d-' % pid) and name.endswith('.json'):
+                path = os.path.join(self.directory, name)
+                with open(path) as saved:
+                    figures = json.load(saved)
+                figures['gauges'] = {}
+                with open(path + '.tmp', 'w') as saved:
+                    json.dump(figures, saved)
+                os.replace(path + '.tmp', path)
+
+    def wipe(self):
+        """Empties the directory, when the server starts."""
+        if not self.directory or not os.path.isdir(self.directory):
+            return
+        for name in os.listdir(self.directory):
+            os.remove(os.path.join(self.directory, name))
+
+metrics_store = MetricsStore()
+
+class Measure:
+    """What one request has used so far."""
+
+    def __init__(self, keep_queries):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.query_time = 0.0
+        self.template_time = 0.0
+        self.size = 0
+        self.template_started = None
+        self.statements = [] if keep_queries else None
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _query_started(connection, cursor, statement, parameters, context, executemany):
+    connection.info.setdefault('flask_book.query_started', []).append(time.perf_counter())
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _query_finished(connection, cursor, statement, parameters, context, executemany):
+    started = connection.info.get('flask_book.query_started')
+    if not started:
+        return
+    spent = time.perf_counter() - started.pop()
+    measure = getattr(_current, 'measure', None)
+    if measure is None:
+        return
+    measure.queries += 1
+    measure.query_time += spent
+    if measure.statements is not None and len(measure.statements) < SLOW_QUERIES_SHOWN:
+        measure.statements.append((spent, statement))
+
+def _template_started(sender, template, context, **extra):
+    measure = getattr(_current, 'measure', None)
+    if measure is not None:
+        measure.template_started = time.perf_counter()
+
+def _template_finished(sender, template, context, **extra):
+    measure = getattr(_current, 'measure', None)
+    if measure is not None and measure.template_started is not None:
+        measure.template_time += time.perf_counter() - measure.template_started
+        measure.template_started = None
+
+class RequestMetrics:
+    """WSGI middleware timing each request until its body has been
+    sent, so streamed exports are measured in full. The endpoint is
+    filled in by the app once it has matched the URL."""
+
+    def __init__(self, wsgi_app, app):
+        self.wsgi_app = wsgi_app
+        self.app = app
+
+    def __call__(self, environ, start_response):
+        slow = self.app.config.get('SLOW_REQUEST_SECONDS')
+        measure = _current.measure = Measure(keep_queries=slow is not None)
+        response = None
+        try:
+            response = self.wsgi_app(environ, start_response)
+            for chunk in response:
+                measure.size += len(chunk)
+                yield chunk
+        finally:
+            if hasattr(response, 'close'):
+                response.close()
+            _current.measure = None
+            self._record(environ, measure, slow)
+
+    def _record(self, environ, measure, slow):
+        endpoint = environ.get(ENDPOINT) or 'unmatched'
+        spent = time.perf_counter() - measure.started
+        request_seconds.observe(endpoint, spent)
+        request_queries.observe(endpoint, measure.queries)
+        query_seconds.observe(endpoint, measure.query_time)
+        template_seconds.observe(endpoint, measure.template_time)
+        response_bytes.observe(endpoint, measure.size)
+        metrics_store.flush_if_due()
+        if slow is not None and spent >= slow:
+            self.app.logger.warning(
+                'Slow request %s %s (%s) took %.3fs, %d queries in %.3fs, templates %.3fs:\n%s',
+                environ.get('REQUEST_METHOD'), environ.get('PATH_INFO'), endpoint, spent,
+                measure.queries, measure.query_time, measure.template_time,
+                '\n'.join('  %.4fs %s' % (took, ' '.join(statement.split())) for took, statement in measure.statements)
+            )
+
+def _note_endpoint():
+    request.environ[ENDPOINT] = request.endpoint
+
+def init_metrics(app):
+    """Wraps the app so every request is measured, sharing the figures
+    through METRICS_DIR when it is set."""
+    metrics_store.directory = app.config['METRICS_DIR']
+    if metrics_store.directory:
+        os.makedirs(metrics_store.directory, exist_ok=True)
+    app.before_request(_note_endpoint)
+    before_render_template.connect(_template_started, app)
+    template_rendered.connect(_template_finished, app)
+    app.wsgi_app = RequestMetrics(app.wsgi_app, app)
+
+def clear_metrics():
+    for histogram in HISTOGRAMS:
+        histogram.clear()
+    metrics_store.remove()
+
+def render_metrics():
+    """Every histogram and the figures of each collector, added up
+    across processes, in the Prometheus text format."""
+    histograms, counters, gauges = metrics_store.collect()
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.render(histograms.get(histogram.name, {})))
+    for kind, values in (('counter', counters), ('gauge', gauges)):
+        for name, value in sorted(values.items()):
+            lines.append('# TYPE %s %s' % (name, kind))
+            lines.append('%s %s' % (name, value))
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,228 @@
+import time
+from sqlalchemy import MetaData, bindparam, inspect, text
+from sqlalchemy.schema import CreateIndex, CreateTable
+from application import db
+from application.models import Films, Collection, CollectionStats, FacetCounts, FilmChanges, Versions, hash_description
+from application.versions import get_version, bump_version
+from application.facets import rebuild_facets
+
+# --- Versioned schema changes that keep the data ---
+
+SCHEMA = 'schema'
+
+def _table_exists(table):
+    return db.engine.has_table(table.name)
+
+def _index_exists(index):
+    return index.name in [found['name'] for found in inspect(db.engine).get_indexes(index.table.name)]
+
+def _index(model, name):
+    return next(index for index in model.__table__.indexes if index.name == name)
+
+def create_table(model):
+    """Creates the table of model unless it is already there."""
+    def step():
+        if not _table_exists(model.__table__):
+            model.__table__.create(bind=db.engine)
+    return 'create table %s' % model.__tablename__, step
+
+def create_index(model, name):
+    """Adds one of the indexes declared on model. On MySQL the table
+    stays readable and writable while the index is built."""
+    index = _index(model, name)
+    def step():
+        if _index_exists(index):
+            return
+        ddl = str(CreateIndex(index).compile(dialect=db.engine.dialect))
+        if db.engine.dialect.name == 'mysql':
+            ddl += ' ALGORITHM=INPLACE LOCK=NONE'
+        with db.engine.begin() as connection:
+            connection.execute(text(ddl))
+    return 'create index %s' % name, step
+
+def remove_duplicate_collections():
+    """Keeps the first row of any film a user owns twice, so the unique
+    index can be built."""
+    def step():
+        with db.engine.begin() as connection:
+            connection.execute(text(
+                'DELETE FROM collection WHERE id NOT IN '
+                '(SELECT id FROM (SELECT MIN(id) AS id FROM collection GROUP BY user_id, films_id) AS keep)'
+            ))
+    return 'remove duplicate collection rows', step
+
+def _column_exists(table, name):
+    return name in [column['name'] for column in inspect(db.engine).get_columns(table.name)]
+
+def add_column(model, name):
+    """Adds a column of model to its table, allowing NULL until it has
+    been filled."""
+    column = model.__table__.c[name]
+    def step():
+        if _column_exists(model.__table__, name):
+            return
+        columnType = column.type.compile(dialect=db.engine.dialect)
+        with db.engine.begin() as connection:
+            connection.execute(text('ALTER TABLE %s ADD COLUMN %s %s' % (model.__tablename__, name, columnType)))
+    return 'add column %s.%s' % (model.__tablename__, name), step
+
+def fill_description_hashes(batch_size=1000):
+    """Hashes the description of every film without one, a batch at
+    a time so no long lock is held."""
+    def step():
+        table = Films.__table__
+        while True:
+            with db.engine.begin() as connection:
+                rows = connection.execute(
+                    table.select().with_only_columns([table.c.id, table.c.description])
+                        .where(table.c.description_hash == None)
+                        .limit(batch_size)
+                ).fetchall()
+                if not rows:
+                    return
+                connection.execute(
+                    table.update().where(table.c.id == bindparam('b_id')).values(description_hash=bindparam('hash')),
+                    [dict(b_id=filmID, hash=hash_description(description)) for filmID, description in rows]
+                )
+    return 'fill films.description_hash', step
+
+def drop_description_unique():
+    """Drops the old unique index on the full description. SQLite
+    keeps it until require_column rebuilds the table."""
+    def step():
+        if db.engine.dialect.name == 'sqlite':
+            return
+        inspector = inspect(db.engine)
+        unique = [found['name'] for found in inspector.get_unique_constraints('films') if found['column_names'] == ['description']]
+        unique += [found['name'] for found in inspector.get_indexes('films') if found['unique'] and found['column_names'] == ['description']]
+        with db.engine.begin() as connection:
+            for name in sorted(set(unique)):
+                if db.engine.dialect.name == 'mysql':
+                    connection.execute(text('ALTER TABLE films DROP INDEX %s' % name))
+                else:
+                    connection.execute(text('ALTER TABLE films DROP CONSTRAINT %s' % name))
+    return 'drop unique index on films.description', step
+
+def _rebuild_sqlite_table(model):
+    """SQLite cannot change a column in place, so the table is made
+    again as the model declares it, the rows copied over and the indexes
+    built again, in one transaction. Foreign keys are off meanwhile so
+    the rows pointing at the old table are kept."""
+    table = model.__table__
+    rebuilt = table.tometadata(MetaData(), name='%s_rebuilt' % table.name)
+    columns = ', '.join(column.name for column in table.columns)
+    with db.engine.connect() as connection:
+        connection.execute(text('PRAGMA foreign_keys=OFF'))
+        try:
+            with connection.begin():
+                connection.execute(CreateTable(rebuilt))
+                connection.execute(text('INSERT INTO %s (%s) SELECT %s FROM %s' % (rebuilt.name, columns, columns, table.name)))
+                connection.execute(text('DROP TABLE %s' % table.name))
+                connection.execute(text('ALTER TABLE %s RENAME TO %s' % (rebuilt.name, table.name)))
+                for index in table.indexes:
+                    index.create(bind=connection)
+        finally:
+            connection.execute(text('PRAGMA foreign_keys=ON'))
+
+def require_column(model, name):
+    """Makes a column NOT NULL, as the model declares it, once every row
+    has a value. SQLite does so by rebuilding the table, which also drops
+    anything the model no longer declares."""
+    column = model.__table__.c[name]
+    def step():
+        found = [found for found in inspect(db.engine).get_columns(model.__tablename__) if found['name'] == name]
+        if found and not found[0]['nullable']:
+            return
+        dialect = db.engine.dialect.name
+        if dialect == 'sqlite':
+            _rebuild_sqlite_table(model)
+            return
+        columnType = column.type.compile(dialect=db.engine.dialect)
+        with db.engine.begin() as connection:
+            if dialect == 'mysql':
+                connection.execute(text('ALTER TABLE %s MODIFY COLUMN %s %s NOT NULL' % (model.__tablename__, name, columnType)))
+            else:
+                connection.execute(text('ALTER TABLE %s ALTER COLUMN %s SET NOT NULL' % (model.__tablename__, name)))
+    return 'require %s.%s' % (model.__tablename__, name), step
+
+def fill_facets():
+    def step():
+        if not db.session.query(FacetCounts).first():
+            rebuild_facets()
+    return 'count facets', step
+
+class Migration:
+    """A numbered set of steps. Every step checks whether its work is
+    already done, so a migration cut short can simply be run again."""
+
+    def __init__(self, number, name, steps):
+        self.number = number
+        self.name = name
+        self.steps = steps
+
+MIGRATIONS = [
+    Migration(1, 'tables for facets and collection stats', [
+        create_table(FacetCounts),
+        create_table(CollectionStats),
+        fill_facets(),
+    ]),
+    Migration(2, 'collection indexes', [
+        remove_duplicate_collections(),
+        create_index(Collection, 'ix_collection_user_films'),
+        create_index(Collection, 'ix_collection_films'),
+    ]),
+    Migration(3, 'catalogue indexes', [
+        create_index(Films, 'ix_films_title_id'),
+        create_index(Films, 'ix_films_year_id'),
+        create_index(Films, 'ix_films_director_id'),
+        create_index(Films, 'ix_films_genre'),
+        create_index(Films, 'ix_films_formating'),
+        create_index(Films, 'ix_films_age'),
+    ]),
+    Migration(4, 'description hash instead of a unique description', [
+        add_column(Films, 'description_hash'),
+        fill_description_hashes(),
+        create_index(Films, 'ix_films_description_hash'),
+        drop_description_unique(),
+    ]),
+    Migration(5, 'description hash required', [
+        fill_description_hashes(),
+        require_column(Films, 'description_hash'),
+    ]),
+    Migration(6, 'film change log', [
+        create_table(FilmChanges),
+    ]),
+]
+
+def schema_version():
+    if not _table_exists(Versions.__table__):
+        return 0
+    return get_version(SCHEMA)
+
+def pending():
+    current = schema_version()
+    return [migration for migration in MIGRATIONS if migration.number > current]
+
+def migrate(report=None):
+    """Applies every migration newer than the stored schema version in
+    order, recording each one as it finishes. report is given the
+    migration, the step and the seconds it took. Returns the numbers
+    applied."""
+    Versions.__table__.create(bind=db.engine, checkfirst=True)
+    applied = []
+    for migration in pending():
+        for description, step in migration.steps:
+            started = time.time()
+            step()
+            if report:
+                report(migration, description, time.time() - started)
+        bump_version(SCHEMA)
+        db.session.commit()
+        applied.append(migration.number)
+    return applied
+
+def stamp():
+    """Marks a DATABASE made by create_all as fully migrated."""
+    while schema_version() < MIGRATIONS[-1].number:
+        bump_version(SCHEMA)
+    db.session.commit()
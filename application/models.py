@@ -1,10 +1,35 @@
 from application import db, login_manager
+from application.cache import user_cache
 from flask_login import UserMixin
 from datetime import datetime
+from sqlalchemy import event
+import hashlib
 
 @login_manager.user_loader
 def load_user(id):
-    return Users.query.get(int(id))
+    """Users are kept detached in the user_cache for a few minutes and
+    merged back into the session without a query on each request.
+    'account' and 'account_delete' drop the cached copy."""
+    user = user_cache.get(int(id))
+    if user is None:
+        user = Users.query.get(int(id))
+        if user is None:
+            return None
+        db.session.expunge(user)
+        user_cache.set(int(id), user)
+    return db.session.merge(user, load=False)
+
+# columns a film is made of, in the order used for importing and exporting
+FILM_FIELDS = ('title', 'year', 'age', 'director', 'genre', 'formating', 'description', 'code')
+
+def hash_description(description):
+    """The fixed width key the no duplicate descriptions rule is kept by.
+    Case and trailing spaces are ignored, as the case insensitive, pad
+    space collation of the old unique description column did on MySQL."""
+    return hashlib.sha256(description.rstrip().casefold().encode('utf-8')).hexdigest()
+
+def _description_hash_default(context):
+    return hash_description(context.get_current_parameters()['description'])
 
 class Films(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -14,9 +39,23 @@ class Films(db.Model):
     director = db.Column(db.String(100), nullable=False)
     genre = db.Column(db.String(20), nullable=False)
     formating = db.Column(db.String(10), nullable=False)
-    description = db.Column(db.String(1000), nullable=False, unique=True)
+    description = db.Column(db.String(1000), nullable=False)
+    description_hash = db.Column(db.String(64), nullable=False, default=_description_hash_default)
     code = db.Column(db.Integer, nullable=False, unique=True)
-    owners = db.relationship('Collection', backref='owners', lazy=True)
+    owners = db.relationship('Collection', backref='owners', lazy=True, passive_deletes=True)
+    __table_args__ = (
+        # (sort column, id) pairs used by keyset pagination on the catalogue
+        db.Index('ix_films_title_id', 'title', 'id'),
+        db.Index('ix_films_year_id', 'year', 'id'),
+        db.Index('ix_films_director_id', 'director', 'id'),
+        # facet filters on the catalogue, year is served by ix_films_year_id
+        db.Index('ix_films_genre', 'genre'),
+        db.Index('ix_films_formating', 'formating'),
+        db.Index('ix_films_age', 'age'),
+        # no two films share a description, kept on the hash rather than
+        # on the 1000 character column itself
+        db.Index('ix_films_description_hash', 'description_hash', unique=True),
+    )
 
     def __repr__(self):
         return ''.join([
@@ -26,10 +65,20 @@ class Films(db.Model):
             str(self.code)
             ])
 
+@event.listens_for(Films.description, 'set')
+def _rehash_description(film, description, old, initiator):
+    film.description_hash = hash_description(description)
+
 class Collection(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
-    films_id = db.Column(db.Integer, db.ForeignKey('films.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    films_id = db.Column(db.Integer, db.ForeignKey('films.id', ondelete='CASCADE'), nullable=False)
+    __table_args__ = (
+        # a user owns a film at most once, also serves the ownership lookups
+        db.Index('ix_collection_user_films', 'user_id', 'films_id', unique=True),
+        # the owners of a film, for edits and deletes of the film
+        db.Index('ix_collection_films', 'films_id'),
+    )
 
     def __repr__(self):
         return ''.join([
@@ -38,13 +87,58 @@ class Collection(db.Model):
             'Film ID: ', str(self.films_id)           
             ])
 
+class CollectionStats(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    films = db.Column(db.Integer, nullable=False, default=0)
+    counts = db.Column(db.Text, nullable=False, default='{}') # JSON, see application/stats.py
+
+    def __repr__(self):
+        return ''.join([
+            'User ID: ', str(self.user_id), ' owns ', str(self.films), ' films'
+            ])
+
+class FacetCounts(db.Model):
+    facet = db.Column(db.String(20), primary_key=True)
+    value = db.Column(db.String(100), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return ''.join([
+            'Facet: ', self.facet, ' ', self.value, ' (', str(self.count), ')'
+            ])
+
+class FilmChanges(db.Model):
+    """Which films each 'films' version changed, so a process whose
+    in-memory indexes are behind can re-read only those films."""
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False)
+    film_id = db.Column(db.Integer, nullable=False)
+    __table_args__ = (
+        db.Index('ix_film_changes_version', 'version'),
+    )
+
+    def __repr__(self):
+        return ''.join([
+            'Film change: ', str(self.film_id), ' at ', str(self.version)
+            ])
+
+class Versions(db.Model):
+    name = db.Column(db.String(50), primary_key=True)
+    value = db.Column(db.Integer, nullable=False, default=0)
+    updated = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return ''.join([
+            'Version: ', self.name, ' ', str(self.value)
+            ])
+
 class Users(db.Model, UserMixin):
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(500), nullable=False, unique=True)
     password = db.Column(db.String(500), nullable=False)
     first_name = db.Column(db.String(30), nullable=False)
     last_name = db.Column(db.String(30), nullable=False)
-    collection = db.relationship('Collection', backref='owner', lazy=True) # relats table to Collection table
+    collection = db.relationship('Collection', backref='owner', lazy=True, passive_deletes=True) # relats table to Collection table
 
     def __repr__(self):
         return ''.join([
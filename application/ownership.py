@@ -0,0 +1,56 @@
+from application import db
+from application.models import Films, Collection
+from application.versions import bump_version, collection_version
+from application.stats import adjust_stats, films_stats
+from application.recommend import recommender
+
+# --- Set based changes to a users collection ---
+
+CHUNK = 500
+
+def chunks(items):
+    items = list(items)
+    for start in range(0, len(items), CHUNK):
+        yield items[start:start + CHUNK]
+
+def _existing_films(filmIDs):
+    found = set()
+    for chunk in chunks(filmIDs):
+        found.update(filmID for filmID, in db.session.query(Films.id).filter(Films.id.in_(chunk)))
+    return found
+
+def _owned(userID, filmIDs):
+    owned = set()
+    for chunk in chunks(filmIDs):
+        owned.update(filmID for filmID, in db.session.query(Collection.films_id)
+            .filter(Collection.user_id == userID)
+            .filter(Collection.films_id.in_(chunk)))
+    return owned
+
+def update_collection(userID, add=(), remove=()):
+    """Adds and removes films from a users collection in one transaction,
+    using an insert that ignores films already owned and a bulk delete,
+    so repeating the same call changes nothing. A film in both lists
+    ends up removed. Returns the films added and removed and any ids
+    that are not in the catalogue."""
+    add, remove = set(add), set(remove)
+    known = _existing_films(add | remove)
+    before = _owned(userID, known)
+    after = (before | (add & known)) - remove
+    added = sorted(after - before)
+    removed = sorted(before - after)
+    if added:
+        db.session.execute(
+            Collection.__table__.insert()
+                .prefix_with('IGNORE', dialect='mysql')
+                .prefix_with('OR IGNORE', dialect='sqlite'),
+            [{'user_id': userID, 'films_id': filmID} for filmID in added]
+        )
+    for chunk in chunks(removed):
+        Collection.query.filter_by(user_id=userID).filter(Collection.films_id.in_(chunk)).delete(synchronize_session=False)
+    if added or removed:
+        adjust_stats([userID], added=films_stats(added), removed=films_stats(removed), films=len(added) - len(removed))
+        bump_version(collection_version(userID))
+    db.session.commit()
+    recommender.collection_changed(userID, added, removed)
+    return dict(added=added, removed=removed, unknown=sorted((add | remove) - known))
@@ -0,0 +1,80 @@
+import base64
+import json
+from flask import abort
+from sqlalchemy import and_, or_
+from application.models import Films
+
+# --- Keyset (cursor) pagination for the Films table ---
+
+SORT_COLUMNS = {
+    'title': Films.title,
+    'year': Films.year,
+    'director': Films.director,
+    'id': Films.id
+}
+
+class Page:
+    """A single page of films along with the cursors needed to
+    move to the next and previous pages. A cursor of None means
+    there is nothing further in that direction."""
+
+    def __init__(self, films, sort, next_cursor=None, prev_cursor=None):
+        self.films = films
+        self.sort = sort
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+def encode_cursor(film, sort):
+    """Packs the sort value and id of a film into an url safe string."""
+    value = getattr(film, sort)
+    raw = json.dumps([value, film.id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii')
+
+def decode_cursor(cursor):
+    """Unpacks a cursor made by encode_cursor, a cursor that has been
+    tampered with results in a 400 rather than a server error."""
+    try:
+        value, filmID = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return value, int(filmID)
+    except (ValueError, TypeError):
+        abort(400)
+
+def _seek(column, value, filmID, forwards):
+    """Builds the WHERE clause that skips straight past the cursor row
+    using the (column, id) index rather than an OFFSET scan."""
+    if column is Films.id:
+        return Films.id > filmID if forwards else Films.id < filmID
+    if forwards:
+        return or_(column > value, and_(column == value, Films.id > filmID))
+    return or_(column < value, and_(column == value, Films.id < filmID))
+
+def keyset_page(query, sort='title', after=None, before=None, per_page=50):
+    """Returns a Page of films from query ordered by sort then id. Only
+    per_page + 1 rows are ever read, so page N costs the same as page 1."""
+    if sort not in SORT_COLUMNS:
+        sort = 'title'
+    column = SORT_COLUMNS[sort]
+    backwards = before is not None and after is None
+    cursor = before if backwards else after
+
+    if cursor is not None:
+        value, filmID = decode_cursor(cursor)
+        query = query.filter(_seek(column, value, filmID, not backwards))
+    if backwards:
+        query = query.order_by(column.desc(), Films.id.desc())
+    else:
+        query = query.order_by(column.asc(), Films.id.asc())
+
+    films = query.limit(per_page + 1).all()
+    more = len(films) > per_page
+    films = films[:per_page]
+    if backwards:
+        films.reverse()
+
+    if not films:
+        return Page(films, sort)
+    first = encode_cursor(films[0], sort)
+    last = encode_cursor(films[-1], sort)
+    if backwards:
+        return Page(films, sort, next_cursor=last, prev_cursor=first if more else None)
+    return Page(films, sort, next_cursor=last if more else None, prev_cursor=first if cursor else None)
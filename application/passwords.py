@@ -0,0 +1,110 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from application import bcrypt
+
+# --- Password hashing on a bounded pool of threads ---
+
+class PoolBusy(Exception):
+    """Raised when every hashing thread and queue slot is taken."""
+
+class HashPool:
+    """Runs bcrypt calls on a fixed number of threads (bcrypt lets go of
+    the GIL while hashing) with at most queue_size calls waiting. Keeps
+    counts of the work done so the queue depth can be watched."""
+
+    def __init__(self, workers, queue_size, timeout):
+        self.workers = workers
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self._lock = threading.Lock()
+        self._start = threading.Lock()
+        self._executor = None
+        self._pid = None
+        self.queued = 0
+        self.active = 0
+        self.completed = 0
+        self.rejected = 0
+        self.wait_seconds = 0.0
+
+    def configure(self, config):
+        """Sizes the pool from the app config, before it is first used."""
+        if self._executor is None:
+            self.workers = config['BCRYPT_POOL_SIZE']
+            self.timeout = config['BCRYPT_QUEUE_TIMEOUT']
+            self._slots = threading.BoundedSemaphore(self.workers + config['BCRYPT_QUEUE_SIZE'])
+
+    def _pool(self):
+        # threads do not survive a fork, so each worker process starts its
+        # own, once, however many requests ask for it at the same time
+        with self._start:
+            if self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='bcrypt')
+                self._pid = os.getpid()
+            return self._executor
+
+    def _count(self, **changes):
+        with self._lock:
+            for name, change in changes.items():
+                setattr(self, name, getattr(self, name) + change)
+
+    def run(self, function, *args):
+        if not self._slots.acquire(timeout=self.timeout):
+            self._count(rejected=1)
+            raise PoolBusy()
+        queuedAt = time.monotonic()
+        self._count(queued=1)
+
+        def task():
+            self._count(queued=-1, active=1, wait_seconds=time.monotonic() - queuedAt)
+            try:
+                return function(*args)
+            finally:
+                self._count(active=-1, completed=1)
+                self._slots.release()
+
+        return self._pool().submit(task).result()
+
+    def stats(self):
+        with self._lock:
+            return dict(
+                queued=self.queued,
+                active=self.active,
+                completed=self.completed,
+                rejected=self.rejected,
+                wait_seconds=self.wait_seconds
+            )
+
+hash_pool = HashPool(os.cpu_count() or 1, 32, 5)
+
+def pool_metrics():
+    """The running totals of the hashing pool as counters and its
+    current queue as gauges, for the metrics page."""
+    stats = hash_pool.stats()
+    counters = [
+        ('flask_book_hash_pool_%s_total' % name, stats[name])
+        for name in ('completed', 'rejected', 'wait_seconds')
+    ]
+    gauges = [('flask_book_hash_pool_%s' % name, stats[name]) for name in ('queued', 'active')]
+    return counters, gauges
+
+def _rounds():
+    return current_app.config['BCRYPT_LOG_ROUNDS']
+
+def hash_password(password):
+    return hash_pool.run(bcrypt.generate_password_hash, password, _rounds())
+
+def check_password(hashed, password):
+    return hash_pool.run(bcrypt.check_password_hash, hashed, password)
+
+def needs_rehash(hashed):
+    """True when hashed was made with a different cost than is configured,
+    so it can be replaced at the next successful login."""
+    if isinstance(hashed, bytes):
+        hashed = hashed.decode('utf-8')
+    try:
+        return int(hashed.split('$')[2]) != _rounds()
+    except (IndexError, ValueError):
+        return False
@@ -0,0 +1,273 @@
+import heapq
+import math
+import os
+import threading
+import time
+from array import array
+from collections import defaultdict, Counter
+import numpy as np
+from scipy import sparse
+from application import db
+from application.models import Collection
+
+# --- "Collectors who own this also own" from the Collection table ---
+
+# about how many non-zeros of the film x film product are held at once
+# while building, a block takes as many films as fit
+BLOCK_NONZEROS = 2000000
+# seconds between checks for a newer saved build
+CHECK_EVERY = 5.0
+
+def _blocks(cost, limit):
+    """(start, end) ranges of rows whose costs add up to at most limit,
+    a row costing more than limit on its own is a block by itself."""
+    total = np.cumsum(cost)
+    start = 0
+    while start < len(cost):
+        before = total[start - 1] if start else 0
+        end = max(int(np.searchsorted(total, before + limit, side='right')), start + 1)
+        yield start, end
+        start = end
+
+class Recommender:
+    """Keeps the top_k most similar films for every film, worked out from
+    a sparse user x film ownership matrix. Similarity is the cosine of
+    two films' owner sets: owners in common / sqrt(owners of each).
+
+    The top films are held as numpy arrays, the films for the film at
+    position p in film_ids being others[offsets[p]:offsets[p + 1]]. With
+    a path the index is built by build_recommendations.py, outside the
+    web workers, and each worker loads the saved file whenever a newer
+    one appears. Without one it is built in process on first use.
+    Ownership changes made in this process are added on top as they
+    happen, changes made by other processes show up with the next
+    build."""
+
+    def __init__(self, top_k=20, path=None):
+        self.top_k = top_k
+        self.path = path
+        self._lock = threading.RLock()
+        self._loading = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._set(*self._empty())
+            self.built_at = None
+            self._modified = None
+            self._checked = 0
+
+    @staticmethod
+    def _empty():
+        return (
+            np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int32), np.zeros(1, dtype=np.int64),
+            np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int32)
+        )
+
+    def _set(self, filmIDs, owners, offsets, others, common):
+        self._filmIDs = filmIDs
+        self._owners = owners
+        self._offsets = offsets
+        self._others = others
+        self._common = common
+        self._delta = defaultdict(Counter)
+        self._ownerDelta = Counter()
+        self._removed = set()
+
+    @staticmethod
+    def _read_matrix():
+        users, films = array('l'), array('l')
+        for userID, filmID in db.session.query(Collection.user_id, Collection.films_id).yield_per(10000):
+            users.append(userID)
+            films.append(filmID)
+        users, films = np.frombuffer(users, dtype=np.int_), np.frombuffer(films, dtype=np.int_)
+        userIDs, rows = np.unique(users, return_inverse=True)
+        filmIDs, columns = np.unique(films, return_inverse=True)
+        matrix = sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.int32), (rows, columns)),
+            shape=(len(userIDs), len(filmIDs))
+        )
+        return matrix, filmIDs
+
+    def build(self):
+        """Works out the top_k films for every film a block of films at a
+        time. A film's row of the product has at most as many entries as
+        its owners own films between them, blocks are cut on that so
+        about BLOCK_NONZEROS entries exist at once."""
+        started = time.time()
+        matrix, filmIDs = self._read_matrix()
+        owners = np.asarray(matrix.sum(axis=0)).ravel()
+        byFilm = matrix.T.tocsr()
+        cost = byFilm @ np.asarray(matrix.sum(axis=1)).ravel()
+        counts = np.zeros(len(filmIDs), dtype=np.int64)
+        others, common = [], []
+        for start, end in _blocks(cost, BLOCK_NONZEROS):
+            together = (byFilm[start:end] @ matrix).tocsr()
+            for row in range(together.shape[0]):
+                film = start + row
+                lo, hi = together.indptr[row], together.indptr[row + 1]
+                found, shared = together.indices[lo:hi], together.data[lo:hi]
+                keep = found != film
+                found, shared = found[keep], shared[keep]
+                if not len(found):
+                    continue
+                scores = shared / np.sqrt(owners[film] * owners[found])
+                if len(found) > self.top_k:
+                    # everything tied with the last one kept, so ties go
+                    # to the lowest film id whatever the partition picks
+                    kth = -np.partition(-scores, self.top_k - 1)[self.top_k - 1]
+                    keep = scores >= kth
+                    found, shared, scores = found[keep], shared[keep], scores[keep]
+                best = np.lexsort((found, -scores))[:self.top_k]
+                others.append(filmIDs[found[best]])
+                common.append(shared[best])
+                counts[film] = len(best)
+        offsets = np.zeros(len(filmIDs) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        arrays = (
+            filmIDs.astype(np.int64), owners.astype(np.int32), offsets,
+            np.concatenate(others).astype(np.int64) if others else np.zeros(0, dtype=np.int64),
+            np.concatenate(common).astype(np.int32) if common else np.zeros(0, dtype=np.int32)
+        )
+        with self._lock:
+            self._set(*arrays)
+            self.built_at = started
+
+    def save(self, path):
+        """Writes the built index to path, through a temporary file so a
+        worker never loads half of it."""
+        with self._lock:
+            arrays = dict(
+                film_ids=self._filmIDs, owners=self._owners, offsets=self._offsets,
+                others=self._others, common=self._common, built_at=np.float64(self.built_at or time.time())
+            )
+        temporary = '%s.%d.tmp' % (path, os.getpid())
+        with open(temporary, 'wb') as saved:
+            np.savez(saved, **arrays)
+        os.replace(temporary, path)
+
+    def load(self, path):
+        """Replaces the index with the one saved at path, local changes
+        made since are dropped as the saved build has them."""
+        with np.load(path) as saved:
+            arrays = tuple(saved[name] for name in ('film_ids', 'owners', 'offsets', 'others', 'common'))
+            builtAt = float(saved['built_at'])
+        with self._lock:
+            self._set(*arrays)
+            self.built_at = builtAt
+
+    def _load_newer(self):
+        """Loads the saved build when it has changed, one thread at a
+        time while the others carry on with what is loaded."""
+        if time.time() - self._checked < CHECK_EVERY or not self._loading.acquire(blocking=False):
+            return
+        try:
+            self._checked = time.time()
+            try:
+                modified = os.stat(self.path).st_mtime
+            except FileNotFoundError:
+                return
+            if modified != self._modified:
+                self.load(self.path)
+                self._modified = modified
+        finally:
+            self._loading.release()
+
+    def _ensure(self):
+        if self.path:
+            self._load_newer()
+            return
+        if self.built_at is not None:
+            return
+        with self._lock:
+            # the first requests wait on a single build rather than each
+            # running their own
+            if self.built_at is None:
+                self.build()
+
+    def prepare(self):
+        """Loads the saved build, or builds in process without a path,
+        ahead of the first request."""
+        self._ensure()
+
+    def _position(self, filmID):
+        position = int(np.searchsorted(self._filmIDs, filmID))
+        if position < len(self._filmIDs) and self._filmIDs[position] == filmID:
+            return position
+        return None
+
+    def _owner_count(self, filmID):
+        position = self._position(filmID)
+        owners = 0 if position is None else int(self._owners[position])
+        return owners + self._ownerDelta[filmID]
+
+    def _scored(self, filmID):
+        """(film, score) pairs for filmID with local changes merged in."""
+        common = {}
+        position = self._position(filmID)
+        if position is not None:
+            lo, hi = self._offsets[position], self._offsets[position + 1]
+            common = dict(zip(self._others[lo:hi].tolist(), self._common[lo:hi].tolist()))
+        for other, change in self._delta.get(filmID, {}).items():
+            common[other] = common.get(other, 0) + change
+        owners = self._owner_count(filmID)
+        scored = []
+        for other, count in common.items():
+            if count <= 0 or other in self._removed:
+                continue
+            scale = owners * self._owner_count(other)
+            if scale > 0:
+                scored.append((other, count / math.sqrt(scale)))
+        return scored
+
+    def similar(self, filmID, k=None):
+        """The k films most often owned alongside filmID, best first."""
+        self._ensure()
+        with self._lock:
+            scored = self._scored(int(filmID))
+        return heapq.nlargest(k or self.top_k, scored, key=lambda pair: (pair[1], -pair[0]))
+
+    def suggest(self, owned, k=None):
+        """The k films not in owned that are most similar to those in it."""
+        self._ensure()
+        owned = set(owned)
+        totals = defaultdict(float)
+        with self._lock:
+            for filmID in owned:
+                for other, score in self._scored(filmID):
+                    if other not in owned:
+                        totals[other] += score
+        return heapq.nlargest(k or self.top_k, totals.items(), key=lambda pair: (pair[1], -pair[0]))
+
+    def collection_changed(self, userID, added=(), removed=()):
+        """Adds one users committed collection changes to the index.
+        Nothing is done before the index is first built."""
+        if self.built_at is None or not (added or removed):
+            return
+        owned = [filmID for filmID, in db.session.query(Collection.films_id).filter_by(user_id=userID)]
+        with self._lock:
+            current = set(owned) - set(added)
+            for filmID in added:
+                self._pair(filmID, current, 1)
+                current.add(filmID)
+            current = set(owned) | set(removed)
+            for filmID in removed:
+                current.discard(filmID)
+                self._pair(filmID, current, -1)
+
+    def _pair(self, filmID, others, change):
+        self._ownerDelta[filmID] += change
+        for other in others:
+            self._delta[filmID][other] += change
+            self._delta[other][filmID] += change
+
+    def film_removed(self, filmID):
+        with self._lock:
+            self._removed.add(int(filmID))
+
+recommender = Recommender()
+
+def configure_recommender(config):
+    recommender.top_k = config['RECOMMEND_TOP_K']
+    recommender.path = config['RECOMMEND_PATH']
+    recommender.clear()
@@ -1,23 +1,43 @@
-from flask import render_template, redirect, url_for, request
-from application import app, db, bcrypt
-from application.models import Films, Users, Collection
-from application.forms import FilmsForm, RegistrationForm, LoginForm, UpdateAccountForm
+from flask import Blueprint, Response, current_app, render_template, redirect, url_for, request, jsonify
+from application import db
+from application.database import read_only
+from application.models import Films, Users, Collection, CollectionStats
+from application.forms import FilmsForm, ScanForm, RegistrationForm, LoginForm, UpdateAccountForm
+from application.barcodes import MAX_CODE, parse_codes, scan_into_collection
+from application.ownership import update_collection
+from application.facets import film_facets, adjust_facets, facet_counts, facet_filters
+from application.stats import film_stats, invalidate_stats, get_stats
+from application.export import films_query, export_response
+from application.search import search_index
+from application.duplicates import duplicate_index
+from application.autocomplete import FIELDS, autocomplete_index
+from application.snapshot import catalogue_snapshot
+from application.recommend import recommender
+from application.cache import page_cache, user_cache, render_film
+from application.versions import get_versions, bump_version, bump_films, collection_version
+from application.conditional import validators, is_fresh, with_validators, not_modified
+from application.passwords import PoolBusy, hash_password, check_password, needs_rehash
+from application.metrics import render_metrics
+from application.warmup import readiness
 from flask_login import login_user, current_user, logout_user, login_required
+from sqlalchemy.orm import joinedload
+
+main = Blueprint('main', __name__)
 
 # --- Creating a C.R.U.D site ( Create . Read . Update . Delete ) ---
 
-@app.route('/')
-@app.route('/home')
+@main.route('/')
+@main.route('/home')
 def home():
     return render_template('home.html', title='Home Page')
 
-@app.route('/about')
+@main.route('/about')
 def about():
     return render_template('about.html', title='About Page')
 
 # --- CREATE-START ---
 
-@app.route('/add_movie', methods=['GET', 'POST'])
+@main.route('/add_movie', methods=['GET', 'POST'])
 @login_required
 def add_movie():
     """Using the FilmsForm will add field data to the Films Table. If
@@ -35,57 +55,213 @@ def add_movie():
                 code=form.code.data
         )
         db.session.add(filmData)
+        adjust_facets(added=film_facets(filmData))
+        db.session.flush()
+        version = bump_films([filmData.id])
         db.session.commit()
-        return redirect(url_for('home'))
+        search_index.add(filmData, version)
+        duplicate_index.add(filmData, version)
+        autocomplete_index.add(filmData, version)
+        catalogue_snapshot.add(filmData, version)
+        return redirect(url_for('main.home'))
     else:
         print(form.errors)
     return render_template('add_movie.html', title='add_movie', form=form)
 
-@app.route('/catalogue/<film>/add', methods=['GET','POST'])
+@main.route('/catalogue/<film>/add', methods=['GET','POST'])
 def add_collection(film):
     """If the user requests to add the movie to collection, the
     movie will be filtered within the users current collection.
     If the result of the search turns up no entries, the film will be
     added to the users collection and sent to the 'collection' page."""
-    userID = int(current_user.id)
-    own = Collection.query.filter_by(user_id=current_user.id).filter_by(films_id=film).first()
-    if own == None:
-        filmOwn = Collection(
-            user_id = userID,
-            films_id = film
-        )
-        db.session.add(filmOwn)
-    db.session.commit()
-    return redirect(url_for('collection'))
+    update_collection(int(current_user.id), add=[int(film)])
+    return redirect(url_for('main.collection'))
+
+@main.route('/collection/scan', methods=['GET', 'POST'])
+@login_required
+def scan_collection():
+    """Using the ScanForm the user can paste or upload a list of bar
+    codes. All the films found are added to their collection in one go
+    and any bar codes not in the catalogue are listed back to them."""
+    form = ScanForm()
+    result = None
+    if form.validate_on_submit():
+        text = form.codes.data or ''
+        if form.upload.data:
+            text = text + '\n' + form.upload.data.read().decode('utf-8', 'replace')
+        codes, invalid = parse_codes(text)
+        added, owned, unknown = scan_into_collection(int(current_user.id), codes)
+        result = dict(added=added, owned=owned, unknown=invalid + [str(code) for code in unknown])
+    return render_template('scan.html', title='Scan Bar Codes', form=form, result=result)
+
+@main.route('/collection/batch', methods=['POST'])
+@login_required
+def batch_collection():
+    """Takes a JSON body such as {"add": [1, 2], "remove": [3]} and
+    applies all of it to the users collection in one transaction,
+    replying with the films actually added and removed."""
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        return jsonify(error='expected a JSON object with "add" and/or "remove" lists'), 400
+    lists = {}
+    for name in ('add', 'remove'):
+        filmIDs = body.get(name, [])
+        # JSON true and false are ints to Python, they are not film ids
+        if not isinstance(filmIDs, list) or not all(isinstance(filmID, int) and not isinstance(filmID, bool) for filmID in filmIDs):
+            return jsonify(error='"%s" must be a list of film ids' % name), 400
+        lists[name] = filmIDs
+    delta = update_collection(int(current_user.id), add=lists['add'], remove=lists['remove'])
+    return jsonify(delta)
 
 # --- CREATE---END ---
 # --- READ-START ---
 # --- READ---END ---
 
-@app.route('/catalogue', methods=['GET', 'POST'])
+@main.route('/catalogue', methods=['GET', 'POST'])
+@read_only
 def catalogue():
-    """When opening the 'catalogue' page all the films in the database
-    will be displayed on the screen. On the page the buttons to
-    edit/delete or add to collection are hidden untill the user signs
-    in and creates and account."""
-    filmData = Films.query.all()
-    return render_template('catalogue.html', title='catalogue Page', films=filmData)
-
-@app.route('/collection', methods=['GET', 'POST'])
+    """When opening the 'catalogue' page the films in the database
+    will be displayed a page at a time, sorted by title, year, director
+    or id. The 'after' and 'before' cursors move between pages. On the
+    page the buttons to edit/delete or add to collection are hidden
+    untill the user signs in and creates and account. The genre, year,
+    formating and age facets narrow the films shown and their counts,
+    kept in the FacetCounts table, are listed alongside. The whole
+    rendered page is cached until the catalogue version changes, a hit
+    only reads the version. Films are read from the in memory catalogue
+    snapshot rather than the Films table."""
+    sort = request.args.get('sort', 'title')
+    after = request.args.get('after')
+    before = request.args.get('before')
+    filters = facet_filters(request.args)
+    perPage = current_app.config['CATALOGUE_PER_PAGE']
+    variant = 'user' if current_user.is_authenticated else 'anonymous'
+    versions = get_versions('films')
+    filterKey = tuple(sorted(filters.items()))
+    etag, lastModified = validators(versions, 'catalogue', variant, sort, after, before, perPage, filterKey)
+    # the signed in variant is only for the user it was sent to
+    private = variant == 'user'
+    if is_fresh(etag, lastModified):
+        return not_modified(etag, lastModified, private)
+    version = versions[0][0]
+    key = (version, variant, sort, after, before, perPage, filterKey)
+    body = page_cache.get(key)
+    if body is None:
+        page = catalogue_snapshot.page(filters, sort=sort, after=after, before=before, per_page=perPage, version=version)
+        fragments = [render_film(film, version, variant) for film in page.films]
+        body = render_template('catalogue.html', title='catalogue Page', fragments=fragments,
+            page=page, facets=facet_counts(), filters=filters)
+        page_cache.set(key, body)
+    return with_validators(body, etag, lastModified, private)
+
+@main.route('/catalogue/code/<int(max=%d):code>' % MAX_CODE, methods=['GET'])
+def barcode(code):
+    """Looking up a single film by its bar code."""
+    film = Films.query.filter_by(code=code).first_or_404()
+    return render_template('film.html', title=film.title, film=film)
+
+def _films_in_order(filmIDs):
+    found = {film.id: film for film in Films.query.filter(Films.id.in_(filmIDs))} if filmIDs else {}
+    return [found[filmID] for filmID in filmIDs if filmID in found]
+
+@main.route('/catalogue/search', methods=['GET'])
+@read_only
+def search():
+    """Searching the titles, directors, genres and descriptions of
+    the films using the in memory search index, the best matches are
+    shown first a page at a time."""
+    query = request.args.get('q', '')
+    page = max(request.args.get('page', 1, type=int), 1)
+    perPage = current_app.config['CATALOGUE_PER_PAGE']
+    filmIDs, total = search_index.search(query, page=page, per_page=perPage)
+    filmData = _films_in_order(filmIDs)
+    return render_template('search.html', title='Search', films=filmData,
+        query=query, page=page, per_page=perPage, total=total)
+
+@main.route('/catalogue/autocomplete', methods=['GET'])
+@read_only
+def autocomplete():
+    """Suggesting titles and directors starting with what has been
+    typed so far, from the in memory prefix index, as JSON."""
+    prefix = request.args.get('q', '')
+    field = request.args.get('field', 'all')
+    if field != 'all' and field not in FIELDS:
+        return jsonify(error='"field" must be one of all, %s' % ', '.join(FIELDS)), 400
+    limit = min(max(request.args.get('k', 10, type=int), 1), current_app.config['AUTOCOMPLETE_MAX'])
+    found = autocomplete_index.complete(prefix, FIELDS if field == 'all' else (field,), limit)
+    results = [
+        dict(field=name, value=value, films=films)
+        for name in found for value, films in found[name]
+    ]
+    if field == 'all':
+        results = sorted(results, key=lambda result: -result['films'])[:limit]
+    return jsonify(query=prefix, results=results)
+
+@main.route('/catalogue/<int:filmID>/similar', methods=['GET'])
+@read_only
+def similar(filmID):
+    """Showing the films most often owned by the collectors who own
+    this one, from the in memory recommender."""
+    film = Films.query.get_or_404(filmID)
+    filmData = _films_in_order([other for other, score in recommender.similar(film.id)])
+    return render_template('similar.html', title='Collectors who own this also own',
+        film=film, films=filmData)
+
+@main.route('/collection/suggestions', methods=['GET'])
+@login_required
+@read_only
+def suggestions():
+    """Suggesting films the user does not own yet that are often
+    owned alongside the films in their collection."""
+    owned = [filmID for filmID, in db.session.query(Collection.films_id).filter_by(user_id=int(current_user.id))]
+    filmData = _films_in_order([other for other, score in recommender.suggest(owned)])
+    return render_template('similar.html', title='Suggested for you', film=None, films=filmData)
+
+@main.route('/collection', methods=['GET', 'POST'])
 @login_required
+@read_only
 def collection():
     """Filtering the films within the users collection, when entering
     the 'collection' page, only the films hosted within the users
-    collection will be displayed."""
+    collection will be displayed. The films are joined into the same
+    query so the page does not go back to the DATABASE for each one.
+    If the browser already has the page and neither the collection nor
+    the films have changed since, nothing is rendered."""
     userID = int(current_user.id)
-    myFilms = Collection.query.filter_by(user_id = userID).all()
-    return render_template('collection.html', title='collection', films=myFilms)
+    versions = get_versions('films', collection_version(userID))
+    etag, lastModified = validators(versions, 'collection', userID)
+    if is_fresh(etag, lastModified):
+        return not_modified(etag, lastModified, private=True)
+    myFilms = Collection.query.filter_by(user_id = userID).options(joinedload('owners')).all()
+    page = render_template('collection.html', title='collection', films=myFilms)
+    return with_validators(page, etag, lastModified, private=True)
+
+@main.route('/collection/stats', methods=['GET'])
+@login_required
+def collection_stats():
+    """Showing the totals of the users collection by genre, format,
+    decade and director, read from their summary row."""
+    films, stats = get_stats(int(current_user.id))
+    return render_template('stats.html', title='Collection Stats', films=films, stats=stats)
+
+@main.route('/catalogue/export.<any(csv, jsonl):fmt>', methods=['GET'])
+@read_only
+def export_catalogue(fmt):
+    """Downloading every film in the catalogue as CSV or JSONL."""
+    return export_response(films_query(), fmt, 'catalogue')
+
+@main.route('/collection/export.<any(csv, jsonl):fmt>', methods=['GET'])
+@login_required
+@read_only
+def export_collection(fmt):
+    """Downloading the films in the users collection as CSV or JSONL."""
+    return export_response(films_query(int(current_user.id)), fmt, 'collection')
 
 # --- READ---END ---
 # --- UPDATE-START ---
 
 
-@app.route('/edit_movie/<filmID>', methods=['GET', 'POST'])
+@main.route('/edit_movie/<filmID>', methods=['GET', 'POST'])
 @login_required
 def edit_movie(filmID):
     """Using the FilmForm this pulls data from the Films DATABASE
@@ -94,7 +270,10 @@ def edit_movie(filmID):
     the user wishes to make."""
     form = FilmsForm()
     film = Films.query.filter_by(id=filmID).first()
+    form.film_id = film.id
     if form.validate_on_submit():
+        oldFacets = film_facets(film)
+        oldStats = film_stats(film)
         film.title = form.title.data
         film.year = form.year.data
         film.age = form.age.data
@@ -103,8 +282,16 @@ def edit_movie(filmID):
         film.formating = form.formating.data
         film.description = form.description.data
         film.code = form.code.data
+        adjust_facets(added=film_facets(film), removed=oldFacets)
+        if film_stats(film) != oldStats:
+            invalidate_stats([film.id])
+        version = bump_films([film.id])
         db.session.commit()
-        return redirect(url_for('collection'))
+        search_index.add(film, version)
+        duplicate_index.add(film, version)
+        autocomplete_index.add(film, version)
+        catalogue_snapshot.add(film, version)
+        return redirect(url_for('main.collection'))
     elif request.method =='GET':
         form.title.data = film.title
         form.year.data = film.year
@@ -119,54 +306,81 @@ def edit_movie(filmID):
 # --- UPDATE---END ---
 # --- DELETE-START ---
 
-@app.route('/catalogue/<filmID>/delete', methods=['GET', 'POST'])
+@main.route('/catalogue/<filmID>/delete', methods=['GET', 'POST'])
 @login_required
 def delete(filmID):
-    """When looking to delete a film from the Films tabel this will filter
-    thought all Collection table\, looking for entries of this film in
-    all user collections and deletes them before removing the film."""
+    """When looking to delete a film from the Films tabel this removes
+    every entry of this film in all user collections with a single
+    DELETE before removing the film, however many owners it has."""
     film = Films.query.filter_by(id=filmID).first()
-    collections = Collection.query.filter_by(films_id=filmID).all()
     print("Removing", film.title, "from Database")
-    for collection in collections:
-        db.session.delete(collection)
+    invalidate_stats([film.id])
+    Collection.query.filter_by(films_id=filmID).delete(synchronize_session=False)
     db.session.delete(film)
+    adjust_facets(removed=film_facets(film))
+    version = bump_films([film.id])
     db.session.commit()
-    return redirect(url_for('catalogue'))
+    search_index.remove(filmID, version)
+    duplicate_index.remove(filmID, version)
+    autocomplete_index.remove(filmID, version)
+    catalogue_snapshot.remove(filmID, version)
+    recommender.film_removed(filmID)
+    return redirect(url_for('main.catalogue'))
 
-@app.route('/collection/<film>/delete', methods=['GET', 'POST'])
+@main.route('/collection/<film>/delete', methods=['GET', 'POST'])
 @login_required
 def remove_collection(film):
     """Allowing the user to remove films from their collection, this
     filtersout the film in the Collection table that relates
     to thelogged in user and deletes the DATABASE entry."""
-    userID = int(current_user.id)
-    myFilms = Collection.query.filter_by(user_id=userID).filter_by(films_id=film)
-    for film in myFilms:
-        db.session.delete(film)
-    db.session.commit()
-    return redirect(url_for('collection'))
+    update_collection(int(current_user.id), remove=[int(film)])
+    return redirect(url_for('main.collection'))
 
-@app.route('/coverage')
+@main.route('/coverage')
 def coverage():
     return render_template('coverage.html', title='Tests Page')
 
+@main.route('/metrics')
+def metrics():
+    """Request timings for each endpoint along with the password
+    hashing pool, for Prometheus to scrape. With METRICS_DIR set the
+    figures are those of every worker process added up."""
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+@main.route('/ready')
+def ready():
+    """For the load balancer, 200 once this worker has been warmed
+    and can reach the DATABASE, 503 until then."""
+    if not readiness.ready:
+        return 'warming up', 503
+    try:
+        db.session.execute('SELECT 1')
+    except Exception:
+        return 'DATABASE unavailable', 503
+    return 'ready'
+
 # --- DELETE---END ---
 
 #-----------------------------------------------------------------------------------------------
 #--- USERS -------------------------------------------------------------------------------------
 #-----------------------------------------------------------------------------------------------
 
-@app.route('/register', methods=['GET', 'POST'])
+@main.app_errorhandler(PoolBusy)
+def pool_busy(error):
+    """Too many logins are already waiting on password hashing, the
+    client is asked to try again rather than tying up the worker."""
+    return 'Too many sign ins at once, please try again shortly', 503, {'Retry-After': '1'}
+
+@main.route('/register', methods=['GET', 'POST'])
 def register():
     """If the user is already logged in they are directed to the 'home'
     page. If not then the RegistrationForm is used to collect data
     to be entered into the Users table."""
     if current_user.is_authenticated:
-        return redirect(url_for('home'))
+        return redirect(url_for('main.home'))
     form = RegistrationForm()
     if form.validate_on_submit():
-        hash_pw=bcrypt.generate_password_hash(form.password.data)
+        hash_pw=hash_password(form.password.data)
         user=Users(
             first_name=form.first_name.data,
             last_name=form.last_name.data,
@@ -176,10 +390,10 @@ def register():
         db.session.add(user)
         db.session.commit()
 
-        return redirect(url_for('catalogue'))
+        return redirect(url_for('main.catalogue'))
     return render_template('register.html', title='Register', form=form)
 
-@app.route('/login', methods=['GET', 'POST'])
+@main.route('/login', methods=['GET', 'POST'])
 def login():
     """If the user is already logged in they are directed to the 'home'
     page. If not then they will be requested to provide their
@@ -187,11 +401,15 @@ def login():
     reqires the user to be logged on, the user is directed to
     this page."""
     if current_user.is_authenticated:
-        return redirect(url_for('home'))
+        return redirect(url_for('main.home'))
     form = LoginForm()
     if form.validate_on_submit():
         user = Users.query.filter_by(email=form.email.data).first()
-        if user and bcrypt.check_password_hash(user.password, form.password.data):
+        if user and check_password(user.password, form.password.data):
+            if needs_rehash(user.password):
+                user.password = hash_password(form.password.data)
+                db.session.commit()
+                user_cache.pop(user.id)
             login_user(
                 user,
                 remember=form.remember.data
@@ -200,10 +418,10 @@ def login():
             if next_page:
                 return redirect(next_page)
             else:
-                return redirect(url_for('home'))
+                return redirect(url_for('main.home'))
     return render_template('login.html', title='Login Page', form=form)
 
-@app.route('/account', methods=['GET', 'POST'])
+@main.route('/account', methods=['GET', 'POST'])
 @login_required
 def account():
     """Using the UpdateAccountForm this pulls data from the Users table
@@ -215,35 +433,39 @@ def account():
         current_user.last_name = form.last_name.data
         current_user.email = form.email.data
         db.session.commit()
-        return redirect(url_for('account'))
+        user_cache.pop(current_user.id)
+        return redirect(url_for('main.account'))
     elif request.method =='GET':
         form.first_name =  current_user.first_name
         form.last_name = current_user.last_name
         form.email = current_user.email
     return render_template('account.html', title='Account Page', form=form)
 
-@app.route('/account/delete', methods=['GET', 'POST'])
+@main.route('/account/delete', methods=['GET', 'POST'])
 @login_required
 def account_delete():
-    """This using the Users id will filter out all films in their
-    collection and delete them one by one. Once all are
-    removed it will log the user out and delete their account."""
+    """This using the Users id will remove all films in their
+    collection with a single DELETE. Once all are removed it will
+    log the user out and delete their account."""
     user = current_user.id
     account = Users.query.filter_by(id=user).first()
-    owned = Collection.query.filter_by(user_id=user).all()
     logout_user()
-    for films in owned:
-        db.session.delete(films)
+    owned = [filmID for filmID, in db.session.query(Collection.films_id).filter_by(user_id=user)]
+    Collection.query.filter_by(user_id=user).delete(synchronize_session=False)
+    CollectionStats.query.filter_by(user_id=user).delete(synchronize_session=False)
+    bump_version(collection_version(user))
     db.session.delete(account)
     db.session.commit()
-    return redirect(url_for('register'))
+    recommender.collection_changed(int(user), removed=owned)
+    user_cache.pop(user)
+    return redirect(url_for('main.register'))
 
-@app.route('/logout', methods=['GET', 'POST'])
+@main.route('/logout', methods=['GET', 'POST'])
 def logout():
     """Clicking the Logout button on the menu will Log the user
     out of the site."""
     logout_user()
-    return redirect(url_for('login'))
+    return redirect(url_for('main.login'))
 
 #-----------------------------------------------------------------------------------------------
 #--- USERS - END -------------------------------------------------------------------------------
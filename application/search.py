@@ -0,0 +1,138 @@
+import math
+import re
+import threading
+from collections import defaultdict
+from application import db
+from application.models import Films
+from application.versions import get_version, film_changes_since
+
+# --- In-process full text search over the Films table ---
+
+FIELD_WEIGHTS = {
+    'title': 3.0,
+    'director': 2.0,
+    'genre': 2.0,
+    'description': 1.0
+}
+
+WORD = re.compile(r'[a-z0-9]+')
+
+def tokenize(text):
+    """Splits text into lower case words, punctuation is dropped."""
+    return WORD.findall(str(text).lower())
+
+class SearchIndex:
+    """An inverted index mapping each word to the films containing it,
+    with a weight for how often and in which fields it appears. The
+    index remembers the 'films' version it was built at. Writes made in
+    this process are applied to it directly, while a version bumped by
+    any other process is caught up with on the next search."""
+
+    def __init__(self):
+        self._postings = defaultdict(dict)
+        self._words = {}
+        self._lock = threading.RLock()
+        self.built = False
+        self.version = None
+
+    def _weights(self, film):
+        weights = defaultdict(float)
+        for field, weight in FIELD_WEIGHTS.items():
+            for word in tokenize(getattr(film, field)):
+                weights[word] += weight
+        return weights
+
+    def _index(self, film):
+        weights = self._weights(film)
+        for word, weight in weights.items():
+            self._postings[word][film.id] = weight
+        self._words[film.id] = set(weights)
+
+    def _unindex(self, filmID):
+        for word in self._words.pop(filmID, ()):
+            films = self._postings.get(word)
+            if films is not None:
+                films.pop(filmID, None)
+                if not films:
+                    del self._postings[word]
+
+    def build(self, version=None):
+        """(Re)builds the whole index, reading only the searched columns."""
+        columns = [Films.id] + [getattr(Films, field) for field in FIELD_WEIGHTS]
+        with self._lock:
+            self._postings = defaultdict(dict)
+            self._words = {}
+            for film in db.session.query(*columns).yield_per(1000):
+                self._index(film)
+            self.built = True
+            self.version = version
+
+    def clear(self):
+        """Forgets everything, the next search rebuilds from the DATABASE."""
+        with self._lock:
+            self._postings = defaultdict(dict)
+            self._words = {}
+            self.built = False
+            self.version = None
+
+    def _follows(self, version):
+        """True when version is the very next change after the index, any
+        gap means another process wrote in between."""
+        if self.built and self.version == version - 1:
+            self.version = version
+            return True
+        return False
+
+    def add(self, film, version):
+        """Adds a new film or re-indexes an edited one, version being
+        the 'films' version the write was committed with."""
+        with self._lock:
+            if self._follows(version):
+                self._unindex(film.id)
+                self._index(film)
+
+    def remove(self, filmID, version):
+        with self._lock:
+            if self._follows(version):
+                self._unindex(int(filmID))
+
+    def catch_up(self, version):
+        """Brings the index up to version by re-reading only the films
+        changed since, building it again when the change log does not
+        cover the gap. An index already past version is left as it is."""
+        with self._lock:
+            if self.built and self.version is not None and self.version >= version:
+                return
+            changed = film_changes_since(self.version, version) if self.built else None
+            if changed is None:
+                self.build(version)
+                return
+            for filmID in changed:
+                self._unindex(filmID)
+            if changed:
+                columns = [Films.id] + [getattr(Films, field) for field in FIELD_WEIGHTS]
+                for film in db.session.query(*columns).filter(Films.id.in_(changed)):
+                    self._index(film)
+            self.version = version
+
+    def search(self, query, page=1, per_page=20):
+        """Returns (film ids, total matches) for one page of results.
+        Films are ranked by the sum of their field weights for each word,
+        scaled so that rare words count for more than common ones."""
+        version = get_version('films')
+        with self._lock:
+            self.catch_up(version)
+            total = len(self._words)
+            scores = defaultdict(float)
+            for word in set(tokenize(query)):
+                films = self._postings.get(word)
+                if not films:
+                    continue
+                rarity = math.log(1 + total / len(films))
+                for filmID, weight in films.items():
+                    scores[filmID] += weight * rarity
+        ranked = sorted(scores, key=lambda filmID: (-scores[filmID], filmID))
+        start = (page - 1) * per_page
+        return ranked[start:start + per_page], len(ranked)
+
+search_index = SearchIndex()
@@ -0,0 +1,192 @@
+import threading
+from bisect import bisect_left, bisect_right, insort
+from flask import abort
+from application import db
+from application.models import Films
+from application.facets import FACETS
+from application.pagination import SORT_COLUMNS, Page, encode_cursor, decode_cursor
+from application.versions import get_version, film_changes_since
+
+# --- The Films table held in memory for the catalogue ---
+
+COLUMNS = ('id', 'title', 'year', 'age', 'director', 'genre', 'formating', 'description', 'code')
+
+class FilmRow:
+    """One film as plain values, enough to render film_block.html."""
+
+    __slots__ = COLUMNS
+
+    def __init__(self, *values):
+        for column, value in zip(COLUMNS, values):
+            setattr(self, column, value)
+
+def _facet_value(facet, value):
+    """A filter value as stored in the facet sets, years are compared
+    as numbers so '02020' still finds 2020."""
+    if facet == 'year':
+        try:
+            return str(int(value))
+        except ValueError:
+            return None
+    return value
+
+class CatalogueSnapshot:
+    """Every film as a FilmRow, a sorted list of (value, id) keys for
+    each catalogue sort and the ids under each facet value. Kept in step
+    with the 'films' version the same way as the search index, so the
+    catalogue is paged and filtered without querying Films."""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._rows = {}
+            self._orders = {sort: [] for sort in SORT_COLUMNS}
+            self._facets = {facet: {} for facet in FACETS}
+            self.built = False
+            self.version = None
+
+    def _index(self, row):
+        self._rows[row.id] = row
+        for sort, keys in self._orders.items():
+            insort(keys, (getattr(row, sort), row.id))
+        for facet in FACETS:
+            self._facets[facet].setdefault(str(getattr(row, facet)), set()).add(row.id)
+
+    def _unindex(self, filmID):
+        row = self._rows.pop(filmID, None)
+        if row is None:
+            return
+        for sort, keys in self._orders.items():
+            position = bisect_left(keys, (getattr(row, sort), filmID))
+            if position < len(keys) and keys[position][1] == filmID:
+                del keys[position]
+        for facet in FACETS:
+            value = str(getattr(row, facet))
+            films = self._facets[facet].get(value)
+            if films is not None:
+                films.discard(filmID)
+                if not films:
+                    del self._facets[facet][value]
+
+    def build(self, version=None):
+        with self._lock:
+            self._rows = {
+                row.id: FilmRow(*row)
+                for row in db.session.query(*[getattr(Films, column) for column in COLUMNS]).yield_per(1000)
+            }
+            self._orders = {
+                sort: sorted((getattr(row, sort), row.id) for row in self._rows.values())
+                for sort in SORT_COLUMNS
+            }
+            self._facets = {facet: {} for facet in FACETS}
+            for row in self._rows.values():
+                for facet in FACETS:
+                    self._facets[facet].setdefault(str(getattr(row, facet)), set()).add(row.id)
+            self.built = True
+            self.version = version
+
+    def _follows(self, version):
+        if self.built and self.version == version - 1:
+            self.version = version
+            return True
+        return False
+
+    def add(self, film, version):
+        with self._lock:
+            if self._follows(version):
+                self._unindex(film.id)
+                self._index(FilmRow(*[getattr(film, column) for column in COLUMNS]))
+
+    def remove(self, filmID, version):
+        with self._lock:
+            if self._follows(version):
+                self._unindex(int(filmID))
+
+    def catch_up(self, version):
+        """Re-reads only the films changed since the snapshot, see
+        SearchIndex.catch_up."""
+        with self._lock:
+            # a snapshot already past version has only taken in later changes
+            if self.built and self.version is not None and self.version >= version:
+                return
+            changed = film_changes_since(self.version, version) if self.built else None
+            if changed is None:
+                self.build(version)
+                return
+            for filmID in changed:
+                self._unindex(filmID)
+            if changed:
+                columns = [getattr(Films, column) for column in COLUMNS]
+                for row in db.session.query(*columns).filter(Films.id.in_(changed)):
+                    self._index(FilmRow(*row))
+            self.version = version
+
+    def _current(self, version=None):
+        if version is None:
+            version = get_version('films')
+        self.catch_up(version)
+
+    def _matching(self, filters):
+        """The ids of films matching every filter, None when unfiltered."""
+        found = sorted(
+            (self._facets[facet].get(_facet_value(facet, value), set()) for facet, value in filters.items()),
+            key=len
+        )
+        if not found:
+            return None
+        # starting from the smallest set keeps every intersection small
+        matching = found[0]
+        for films in found[1:]:
+            matching = matching & films
+        return matching
+
+    def page(self, filters=None, sort='title', after=None, before=None, per_page=50, version=None):
+        """A Page of FilmRows matching filters, the same as keyset_page
+        would give for the Films table."""
+        if sort not in SORT_COLUMNS:
+            sort = 'title'
+        backwards = before is not None and after is None
+        cursor = before if backwards else after
+        with self._lock:
+            self._current(version)
+            matching = self._matching(filters or {})
+            keys = self._orders[sort]
+            # walking the whole order passes about per_page * len(keys) /
+            # len(matching) keys, a few matching films are quicker sorted
+            if matching is not None and len(matching) ** 2 < per_page * len(keys):
+                keys = sorted((getattr(self._rows[filmID], sort), filmID) for filmID in matching)
+                matching = None
+            if cursor is None:
+                position = len(keys) if backwards else 0
+            else:
+                try:
+                    seek = decode_cursor(cursor)
+                    position = bisect_left(keys, seek) if backwards else bisect_right(keys, seek)
+                except TypeError:
+                    abort(400)
+            step = -1 if backwards else 1
+            if backwards:
+                position -= 1
+            films = []
+            while 0 <= position < len(keys) and len(films) <= per_page:
+                filmID = keys[position][1]
+                if matching is None or filmID in matching:
+                    films.append(self._rows[filmID])
+                position += step
+        more = len(films) > per_page
+        films = films[:per_page]
+        if backwards:
+            films.reverse()
+
+        if not films:
+            return Page(films, sort)
+        first = encode_cursor(films[0], sort)
+        last = encode_cursor(films[-1], sort)
+        if backwards:
+            return Page(films, sort, next_cursor=last, prev_cursor=first if more else None)
+        return Page(films, sort, next_cursor=last if more else None, prev_cursor=first if cursor else None)
+
+catalogue_snapshot = CatalogueSnapshot()
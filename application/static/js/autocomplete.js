@@ -0,0 +1,30 @@
+// Fills a datalist under every input marked data-autocomplete="title",
+// "director" or "all" with suggestions for what has been typed so far.
+document.addEventListener('DOMContentLoaded', function () {
+    var url = document.body.getAttribute('data-autocomplete-url');
+    var inputs = document.querySelectorAll('input[data-autocomplete]');
+    Array.prototype.forEach.call(inputs, function (input, number) {
+        var list = document.createElement('datalist');
+        var waiting = null;
+        list.id = 'autocomplete-' + number;
+        input.parentNode.insertBefore(list, input.nextSibling);
+        input.setAttribute('list', list.id);
+        input.setAttribute('autocomplete', 'off');
+        input.addEventListener('input', function () {
+            clearTimeout(waiting);
+            waiting = setTimeout(function () {
+                var query = '?field=' + input.getAttribute('data-autocomplete') + '&q=' + encodeURIComponent(input.value);
+                fetch(url + query).then(function (response) {
+                    return response.json();
+                }).then(function (found) {
+                    list.innerHTML = '';
+                    found.results.forEach(function (result) {
+                        var option = document.createElement('option');
+                        option.value = result.value;
+                        list.appendChild(option);
+                    });
+                });
+            }, 100);
+        });
+    });
+});
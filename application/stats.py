@@ -0,0 +1,105 @@
+import json
+from collections import Counter
+from types import SimpleNamespace
+from sqlalchemy import select
+from application import db
+from application.models import Films, Collection, CollectionStats
+
+# --- Per user collection totals, kept up to date as collections change ---
+
+STATS = ('genre', 'formating', 'decade', 'director')
+
+CHUNK = 500
+
+def film_stats(film):
+    """The (stat, value) pairs a film, or a dict of its columns, is
+    counted under."""
+    if isinstance(film, dict):
+        film = SimpleNamespace(**film)
+    return [
+        ('genre', film.genre),
+        ('formating', film.formating),
+        ('decade', '%ds' % (film.year // 10 * 10)),
+        ('director', film.director)
+    ]
+
+def _load(counts):
+    loaded = json.loads(counts or '{}')
+    return {stat: Counter(loaded.get(stat, {})) for stat in STATS}
+
+def _dump(counts):
+    return json.dumps({stat: {value: count for value, count in counts[stat].items() if count > 0} for stat in STATS})
+
+def _rows(userIDs):
+    rows = []
+    userIDs = list(userIDs)
+    for start in range(0, len(userIDs), CHUNK):
+        rows.extend(CollectionStats.query
+            .filter(CollectionStats.user_id.in_(userIDs[start:start + CHUNK]))
+            .with_for_update())
+    return rows
+
+def adjust_stats(userIDs, added=(), removed=(), films=0):
+    """Applies the same change to the summary of each user in userIDs
+    as part of the current transaction: the (stat, value) pairs added
+    and removed, and films the change in how many films they own. Users
+    without a summary yet are skipped, theirs is built in full when it
+    is first read."""
+    changes = Counter(added)
+    changes.subtract(Counter(removed))
+    if not films and not any(changes.values()):
+        return
+    for row in _rows(userIDs):
+        counts = _load(row.counts)
+        for (stat, value), change in changes.items():
+            counts[stat][value] += change
+        row.counts = _dump(counts)
+        row.films += films
+
+def invalidate_stats(filmIDs):
+    """Drops the summary of every user owning any of filmIDs, as part of
+    the current transaction, with one DELETE per chunk of films however
+    many owners they have. Each is built again in full when next read.
+    Used when films change, where adjusting would rewrite every owners
+    summary."""
+    table = CollectionStats.__table__
+    filmIDs = list(filmIDs)
+    for start in range(0, len(filmIDs), CHUNK):
+        owners = select([Collection.user_id]).where(Collection.films_id.in_(filmIDs[start:start + CHUNK]))
+        db.session.execute(table.delete().where(table.c.user_id.in_(owners)))
+
+def films_stats(filmIDs):
+    """The stat pairs of several films at once, for collection changes."""
+    pairs = []
+    filmIDs = list(filmIDs)
+    for start in range(0, len(filmIDs), CHUNK):
+        for film in db.session.query(Films.genre, Films.formating, Films.year, Films.director) \
+                .filter(Films.id.in_(filmIDs[start:start + CHUNK])):
+            pairs.extend(film_stats(film))
+    return pairs
+
+def build_stats(userID):
+    """Counts a users whole collection and stores it as their summary."""
+    counts = {stat: Counter() for stat in STATS}
+    films = 0
+    rows = db.session.query(Films.genre, Films.formating, Films.year, Films.director) \
+        .join(Collection, Collection.films_id == Films.id) \
+        .filter(Collection.user_id == userID) \
+        .yield_per(1000)
+    for film in rows:
+        films += 1
+        for stat, value in film_stats(film):
+            counts[stat][value] += 1
+    row = CollectionStats.query.get(userID) or CollectionStats(user_id=userID)
+    row.counts = _dump(counts)
+    row.films = films
+    db.session.add(row)
+    db.session.commit()
+    return row
+
+def get_stats(userID):
+    """(films owned, {stat: [(value, count), ...]}) for a user, most
+    common first. Normally a single row read."""
+    row = CollectionStats.query.get(userID) or build_stats(userID)
+    counts = _load(row.counts)
+    return row.films, {stat: counts[stat].most_common() for stat in STATS}
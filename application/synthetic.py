@@ -0,0 +1,93 @@
+import random
+from itertools import accumulate
+from sqlalchemy import func
+from application import db
+from application.models import Films, Users, Collection
+from application.passwords import hash_password
+from application.facets import rebuild_facets
+
+# --- Made up films, users and collections for load testing ---
+
+WORDS = (
+    'Matrix', 'Return', 'Night', 'Storm', 'Empire', 'Shadow', 'River', 'Last', 'Ghost', 'Silent',
+    'Iron', 'Golden', 'Lost', 'City', 'Dawn', 'Winter', 'Star', 'Hidden', 'Broken', 'Wild'
+)
+AGES = ('U', 'PG', '12', '15', '18')
+GENRES = ('Action', 'Comedy', 'Drama', 'Horror', 'Sci-Fi', 'Romance', 'Thriller', 'Animation', 'Documentary', 'Western')
+FORMATS = ('DVD', 'Blu-ray', '4K', 'VHS', 'Digital')
+
+PASSWORD = 'B3nchmark5ecret'
+EMAILS = 'collector%@bench.test'
+
+def _email(number):
+    return 'collector%d@bench.test' % number
+
+def _insert(table, rows, batch_size):
+    for start in range(0, len(rows), batch_size):
+        db.session.execute(table.insert(), rows[start:start + batch_size])
+        db.session.commit()
+
+def make_films(count, rand, start=0):
+    """count films with unique titles, descriptions and bar codes.
+    Directors are shared so some have many films, as they would."""
+    directors = ['Director %d' % number for number in range(max(count // 20, 1))]
+    films = []
+    for number in range(start, start + count):
+        films.append(dict(
+            title='%s %s %d' % (rand.choice(WORDS), rand.choice(WORDS), number),
+            year=rand.randint(1950, 2020),
+            age=rand.choice(AGES),
+            director=rand.choice(directors),
+            genre=rand.choice(GENRES),
+            formating=rand.choice(FORMATS),
+            description='Synthetic film number %d, %s' % (number, ' '.join(rand.sample(WORDS, 6))),
+            code=1000000000 + number
+        ))
+    return films
+
+def make_users(count, hashed, start=0):
+    """count users that all share one password hash, so making them
+    does not cost a bcrypt round each."""
+    return [dict(
+        first_name='Collector',
+        last_name='Number %d' % number,
+        email=_email(number),
+        password=hashed
+    ) for number in range(start, start + count)]
+
+def make_collection(userIDs, filmIDs, owned, rand):
+    """About owned (user, film) rows. Popular films are owned far more
+    often than the rest and some users own far more than others."""
+    weights = list(accumulate(1.0 / (rank + 1) for rank in range(len(filmIDs))))
+    sizes = [rand.paretovariate(1.5) for userID in userIDs]
+    scale = owned / sum(sizes)
+    rows = []
+    for userID, size in zip(userIDs, sizes):
+        want = min(max(int(size * scale), 1), len(filmIDs))
+        mine = set(rand.choices(filmIDs, cum_weights=weights, k=want))
+        while len(mine) < want:
+            mine.add(rand.choice(filmIDs))
+        rows.extend({'user_id': userID, 'films_id': filmID} for filmID in mine)
+    return rows
+
+def generate(films, users, owned, seed=0, batch_size=5000):
+    """Adds films, users and about owned collection rows through the
+    models, then rebuilds the facet counts. Returns how many films,
+    users and collection rows the DATABASE then holds."""
+    rand = random.Random(seed)
+    lastFilm = db.session.query(func.max(Films.id)).scalar() or 0
+    lastUser = db.session.query(func.max(Users.id)).scalar() or 0
+    filmStart = db.session.query(Films).filter(Films.code >= 1000000000).count()
+    userStart = db.session.query(Users).filter(Users.email.like(EMAILS)).count()
+    _insert(Films.__table__, make_films(films, rand, filmStart), batch_size)
+    _insert(Users.__table__, make_users(users, hash_password(PASSWORD), userStart), batch_size)
+    filmIDs = [filmID for filmID, in db.session.query(Films.id).filter(Films.id > lastFilm)]
+    userIDs = [userID for userID, in db.session.query(Users.id).filter(Users.id > lastUser)]
+    if filmIDs and userIDs:
+        _insert(Collection.__table__, make_collection(userIDs, filmIDs, owned, rand), batch_size)
+    rebuild_facets()
+    return dict(
+        films=db.session.query(Films).count(),
+        users=db.session.query(Users).count(),
+        collection=db.session.query(Collection).count()
+    )
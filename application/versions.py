@@ -0,0 +1,74 @@
+from datetime import datetime
+from application import db
+from application.models import Versions, FilmChanges
+
+# --- Change counters shared by every worker through the DATABASE ---
+
+# how many 'films' versions of changed films are kept, an index further
+# behind than this is built again
+CHANGES_KEPT = 1000
+# an index behind by more changed films than this is built again, and
+# writes changing more are not recorded at all
+MAX_CHANGES = 500
+
+def get_version(name):
+    """Reads the named counter, a counter never bumped reads as 0."""
+    return db.session.query(Versions.value).filter_by(name=name).scalar() or 0
+
+def get_versions(*names):
+    """Reads several counters in one query, giving (value, updated) for
+    each name in order. A counter never bumped reads as (0, None)."""
+    found = dict(
+        (row.name, (row.value, row.updated))
+        for row in db.session.query(Versions.name, Versions.value, Versions.updated)
+            .filter(Versions.name.in_(names))
+    )
+    return [found.get(name, (0, None)) for name in names]
+
+def collection_version(userID):
+    """The name of the counter bumped whenever a users collection changes."""
+    return 'collection:%s' % userID
+
+def bump_version(name):
+    """Adds one to the named counter as part of the current transaction,
+    so it is committed along with the change it records. Returns the
+    new value."""
+    updated = db.session.query(Versions).filter_by(name=name).update(
+        {Versions.value: Versions.value + 1, Versions.updated: datetime.utcnow()},
+        synchronize_session=False
+    )
+    if not updated:
+        db.session.add(Versions(name=name, value=1))
+        db.session.flush()
+    return get_version(name)
+
+def bump_films(filmIDs=None):
+    """Bumps the 'films' version and records which films it changed,
+    pruning records older than CHANGES_KEPT versions. With no filmIDs,
+    or too many, nothing is recorded and every index behind is built
+    again. Returns the new version."""
+    version = bump_version('films')
+    if filmIDs and len(filmIDs) <= MAX_CHANGES:
+        db.session.execute(
+            FilmChanges.__table__.insert(),
+            [dict(version=version, film_id=int(filmID)) for filmID in set(filmIDs)]
+        )
+    db.session.query(FilmChanges).filter(FilmChanges.version <= version - CHANGES_KEPT).delete(synchronize_session=False)
+    return version
+
+def film_changes_since(since, current):
+    """The ids of the films changed after version since up to current,
+    or None when the log does not cover every version in between or
+    they are too many to be worth re-reading one by one."""
+    if since is None or current - since > CHANGES_KEPT:
+        return None
+    rows = db.session.query(FilmChanges.version, FilmChanges.film_id).filter(
+        FilmChanges.version > since, FilmChanges.version <= current
+    ).all()
+    # a version bumped without recording its films leaves a gap
+    if len({version for version, filmID in rows}) != current - since:
+        return None
+    changed = {filmID for version, filmID in rows}
+    if len(changed) > MAX_CHANGES:
+        return None
+    return changed
@@ -0,0 +1,129 @@
+import threading
+import time
+from flask import url_for
+from application import db
+from application.search import search_index
+from application.duplicates import duplicate_index
+from application.autocomplete import autocomplete_index
+from application.snapshot import catalogue_snapshot
+from application.recommend import recommender
+from application.versions import get_version
+from application.metrics import clear_metrics
+
+# --- Getting a worker warm before it takes traffic ---
+
+# pages rendered once at start up, filling the page and fragment caches
+# and compiling their templates
+WARM_PAGES = ('main.home', 'main.catalogue')
+
+# seconds between attempts when a worker cannot warm, the DATABASE being
+# unreachable say, it stays not ready meanwhile
+RETRY_EVERY = 5
+
+class Readiness:
+    """Whether this process has been warmed and may be sent requests."""
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    @property
+    def ready(self):
+        return self._event.is_set()
+
+    @ready.setter
+    def ready(self, value):
+        if value:
+            self._event.set()
+        else:
+            self._event.clear()
+
+    def wait(self, timeout=None):
+        return self._event.wait(timeout)
+
+readiness = Readiness()
+
+def warm_caches(app):
+    """Builds the in memory indexes and renders the busiest pages once.
+    Run in the gunicorn master with preload_app, every worker forked
+    afterwards starts with them already in memory."""
+    with app.app_context():
+        search_index.build(get_version('films'))
+        duplicate_index.build(get_version('films'))
+        autocomplete_index.build(get_version('films'))
+        catalogue_snapshot.build(get_version('films'))
+        # off by default, without a saved build from build_recommendations.py
+        # the recommender would be built here and hold up every worker
+        if app.config['WARM_RECOMMENDER']:
+            recommender.prepare()
+        db.session.remove()
+    client = app.test_client()
+    with app.test_request_context():
+        urls = [url_for(endpoint) for endpoint in WARM_PAGES]
+    for url in urls:
+        client.get(url)
+    clear_metrics()
+
+def release_connections(app):
+    """Drops the connections opened while warming, a forked worker must
+    not share sockets with its parent."""
+    with app.app_context():
+        db.session.remove()
+        for bind in [None] + list(app.config.get('SQLALCHEMY_BINDS') or {}):
+            db.get_engine(app, bind=bind).dispose()
+
+def warm_pool(app, connections=None):
+    """Opens connections up to the pool size, or connections, and hands
+    them back, so the first requests do not wait on connecting."""
+    with app.app_context():
+        engine = db.get_engine(app)
+        size = connections or getattr(engine.pool, 'size', lambda: 1)()
+        opened = []
+        try:
+            for _ in range(size):
+                connection = engine.connect()
+                connection.execute('SELECT 1')
+                opened.append(connection)
+        finally:
+            for connection in opened:
+                connection.close()
+    return len(opened)
+
+def catch_up(app):
+    """Catches up any index left behind by films written since the
+    master warmed them, before the fork."""
+    with app.app_context():
+        version = get_version('films')
+        for index in (search_index, duplicate_index, autocomplete_index, catalogue_snapshot):
+            index.catch_up(version)
+        db.session.remove()
+
+def warm_worker(app):
+    """Brings a forked worker up to date and fills its connection pool,
+    only then is it marked ready. Returns the connections opened."""
+    catch_up(app)
+    opened = warm_pool(app)
+    readiness.ready = True
+    return opened
+
+def start_worker_warmup(app, log):
+    """Warms a worker on a thread of its own, so it can already answer
+    /ready with a 503 while it is not done. Keeps trying every
+    RETRY_EVERY seconds until it succeeds."""
+    def run():
+        while True:
+            try:
+                opened = warm_worker(app)
+            except Exception:
+                log.exception('Worker warm up failed, trying again in %ds', RETRY_EVERY)
+                time.sleep(RETRY_EVERY)
+            else:
+                log.info('Worker ready with %d connections', opened)
+                return
+    thread = threading.Thread(target=run, name='warmup', daemon=True)
+    thread.start()
+    return thread
+
+def warm(app):
+    """Everything a single process needs before it is marked ready."""
+    warm_caches(app)
+    warm_worker(app)
@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+
+import argparse
+from application import create_app
+from application.benchmark import run_benchmark, save_results, latest_results, compare
+
+parser = argparse.ArgumentParser(description='Time the busiest routes with concurrent clients.')
+parser.add_argument('routes', nargs='*', help='catalogue, collection, login or add_collection, all by default')
+parser.add_argument('--clients', type=int, default=10, help='concurrent signed in users')
+parser.add_argument('--requests', type=int, default=50, help='requests made by each client per route')
+parser.add_argument('--url', help='an already running server, the app is served locally by default')
+parser.add_argument('--results', default='bench_results', help='folder the runs are stored in')
+parser.add_argument('--seed', type=int, default=0)
+
+if __name__=='__main__':
+    args = parser.parse_args()
+    results = run_benchmark(
+        create_app(),
+        routes=args.routes,
+        clients=args.clients,
+        requests=args.requests,
+        url=args.url,
+        seed=args.seed
+    )
+    path = save_results(results, args.results)
+    for line in compare(results, latest_results(args.results, skip=path)):
+        print(line)
+    print('Saved to', path)
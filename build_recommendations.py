@@ -0,0 +1,19 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import time
+from application import create_app
+from application.recommend import recommender
+
+parser = argparse.ArgumentParser(description='Work out the films collected together and save them for the web workers to load.')
+parser.add_argument('--path', default=os.getenv('FLASK_BOOK_RECOMMEND_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'recommendations.npz')),
+    help='file the workers load, FLASK_BOOK_RECOMMEND_PATH')
+
+if __name__=='__main__':
+    args = parser.parse_args()
+    with create_app(dict(RECOMMEND_PATH=None)).app_context():
+        started = time.time()
+        recommender.build()
+        recommender.save(args.path)
+    print('Recommendations saved to', args.path, '({0:.1f}s)'.format(time.time() - started))
@@ -1,7 +1,10 @@
 #!/usr/bin/env python3
 
-from application import db
+from application import create_app, db
 from application.models import Films, Collection, Users
+from application.migrations import stamp
 
-db.drop_all()
-db.create_all()
\ No newline at end of file
+with create_app().app_context():
+    db.drop_all()
+    db.create_all()
+    stamp()
@@ -0,0 +1,19 @@
+#!/usr/bin/env python3
+
+import argparse
+from application import create_app
+from application.models import Films
+from application.duplicates import duplicate_index, THRESHOLD
+
+parser = argparse.ArgumentParser(description='List groups of films in the catalogue that look like the same film.')
+parser.add_argument('--threshold', type=float, default=THRESHOLD, help='trigram similarity from 0 to 1 needed to count as a copy')
+
+if __name__=='__main__':
+    args = parser.parse_args()
+    with create_app().app_context():
+        groups = duplicate_index.clusters(args.threshold)
+        for number, group in enumerate(groups, start=1):
+            print('Group', number)
+            for film in Films.query.filter(Films.id.in_(group)).order_by(Films.id):
+                print('  {0:>8} {1} ({2}), {3}, {4}, code {5}'.format(film.id, film.title, film.year, film.director, film.formating, film.code))
+    print(len(groups), 'groups of near duplicates')
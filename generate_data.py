@@ -0,0 +1,18 @@
+#!/usr/bin/env python3
+
+import argparse
+from application import create_app
+from application.synthetic import generate
+
+parser = argparse.ArgumentParser(description='Fill the DATABASE with made up films, users and collections for load testing.')
+parser.add_argument('--films', type=int, default=100000)
+parser.add_argument('--users', type=int, default=10000)
+parser.add_argument('--owned', type=int, default=1000000, help='roughly how many Collection rows to add')
+parser.add_argument('--seed', type=int, default=0)
+parser.add_argument('--batch-size', type=int, default=5000, help='rows per insert')
+
+if __name__=='__main__':
+    args = parser.parse_args()
+    with create_app().app_context():
+        totals = generate(args.films, args.users, args.owned, seed=args.seed, batch_size=args.batch_size)
+    print('{films} films, {users} users, {collection} collection rows'.format(**totals))
@@ -0,0 +1,63 @@
+import multiprocessing
+import os
+import tempfile
+
+# --- Production settings, started with: gunicorn -c gunicorn.conf.py app:app ---
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:5000')
+# one process per core, the threads below serve the requests waiting on
+# I/O, and each process holds its own copy of the in-memory indexes
+workers = int(os.getenv('GUNICORN_WORKERS', multiprocessing.cpu_count()))
+# each worker serves several requests at once on its own threads, so a
+# request waiting on the password hashing pool does not hold up the rest
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.getenv('GUNICORN_THREADS', 8))
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 30))
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 0))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', 0))
+
+# password hashing may hold at most BCRYPT_POOL_SIZE + BCRYPT_QUEUE_SIZE
+# of a workers threads, the rest keep serving pages during a burst of
+# logins and the logins beyond that are answered 503
+os.environ.setdefault('BCRYPT_POOL_SIZE', str(max(1, threads // 4)))
+os.environ.setdefault('BCRYPT_QUEUE_SIZE', str(max(1, threads // 4)))
+os.environ.setdefault('BCRYPT_QUEUE_TIMEOUT', '1')
+
+# every worker writes its request metrics here so /metrics can add them
+# up, whichever worker answers the scrape
+os.environ.setdefault('FLASK_BOOK_METRICS_DIR', os.path.join(tempfile.gettempdir(), 'flask_book_metrics'))
+
+# build_recommendations.py saves the recommender here, on a timer, and
+# every worker loads it rather than building it in process
+os.environ.setdefault('FLASK_BOOK_RECOMMEND_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'recommendations.npz'))
+
+# the app, its caches and indexes are loaded once in the master and
+# shared with every worker it forks
+preload_app = True
+
+def on_starting(server):
+    """Forgets the metrics of a previous run."""
+    from application.metrics import MetricsStore
+    MetricsStore(os.getenv('FLASK_BOOK_METRICS_DIR')).wipe()
+
+def when_ready(server):
+    """Warms the preloaded app before any worker is forked, then drops
+    the connections used so no worker inherits an open socket."""
+    from application.warmup import warm_caches, release_connections
+    app = server.app.wsgi()
+    warm_caches(app)
+    release_connections(app)
+    server.log.info('Caches warmed')
+
+def post_worker_init(worker):
+    """Catches the workers indexes up with anything written since the
+    fork and fills its connection pool in the background. /ready answers
+    503 until that is done, so the load balancer holds traffic back."""
+    from application.warmup import start_worker_warmup
+    start_worker_warmup(worker.wsgi, worker.log)
+
+def child_exit(server, worker):
+    """Keeps the counts of a worker that has gone but not its gauges."""
+    from application.metrics import MetricsStore
+    MetricsStore(os.getenv('FLASK_BOOK_METRICS_DIR')).mark_process_dead(worker.pid)
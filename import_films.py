@@ -0,0 +1,25 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+from application import create_app
+from application.importer import import_films
+
+parser = argparse.ArgumentParser(description='Bulk import films from a CSV or JSONL file.')
+parser.add_argument('path', help='file with one film per row, using the Films column names')
+parser.add_argument('--format', choices=['csv', 'jsonl'], help='defaults to the file extension')
+parser.add_argument('--batch-size', type=int, default=1000, help='rows per insert')
+parser.add_argument('--workers', type=int, default=os.cpu_count(), help='validation processes, 0 to validate inline')
+parser.add_argument('--update', action='store_true', help='overwrite films whose bar code already exists')
+
+if __name__=='__main__':
+    args = parser.parse_args()
+    with create_app().app_context():
+        totals = import_films(
+            args.path,
+            fmt=args.format,
+            batch_size=args.batch_size,
+            workers=args.workers,
+            update=args.update
+        )
+    print('{inserted} inserted, {updated} updated, {skipped} skipped, {invalid} invalid'.format(**totals))
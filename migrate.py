@@ -0,0 +1,22 @@
+#!/usr/bin/env python3
+
+import argparse
+from application import create_app
+from application.migrations import migrate, pending, schema_version
+
+parser = argparse.ArgumentParser(description='Bring the DATABASE schema up to date without losing any data.')
+parser.add_argument('--list', action='store_true', help='only show the migrations still to run')
+
+def report(migration, step, seconds):
+    print('{0:>3} {1}: {2} ({3:.2f}s)'.format(migration.number, migration.name, step, seconds))
+
+if __name__=='__main__':
+    args = parser.parse_args()
+    with create_app().app_context():
+        if args.list:
+            print('Schema version', schema_version())
+            for migration in pending():
+                print('{0:>3} {1}'.format(migration.number, migration.name))
+        else:
+            applied = migrate(report)
+            print('Schema version', schema_version(), '-', len(applied), 'migrations applied')
@@ -0,0 +1,7 @@
+#!/usr/bin/env python3
+
+from application import create_app
+from application.facets import rebuild_facets
+
+with create_app().app_context():
+    rebuild_facets()
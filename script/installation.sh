@@ -23,5 +23,13 @@ pytest --cov ./application --cov-report html
 mv ./htmlcov/index.html ./application/templates/coverage.html
 
 rm -rf htmlcov
- 
-gunicorn --bind=0.0.0.0:5000 app:app
\ No newline at end of file
+
+python3 migrate.py
+
+python3 build_recommendations.py
+
+# the tests run here, when Jenkins builds, the service only starts
+# gunicorn through script/start.sh
+sudo systemctl restart flask
+
+sudo systemctl restart recommendations.timer
\ No newline at end of file
@@ -0,0 +1,9 @@
+#!/usr/bin/env bash
+
+cd /var/lib/jenkins/workspace/Flask_book
+
+. /var/lib/jenkins/workspace/Flask_book/venv/bin/activate
+
+source ~/.bashrc
+
+exec gunicorn --config gunicorn.conf.py app:app
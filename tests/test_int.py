@@ -7,7 +7,7 @@ from os import getenv
 from flask_testing import LiveServerTestCase
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
-from application import app, db, bcrypt
+from application import create_app, db, bcrypt
 from application.models import Users
 
 test_admin_first_name = "AdminSystem"
@@ -18,9 +18,10 @@ test_admin_password = "Adm1n"
 class TestBase(LiveServerTestCase):
 
     def create_app(self):
-        app.config['SQLALCHEMY_DATABASE_URI'] = str(getenv('FLASK_BOOK_TEST_URI'))
-        app.config['SECRET_KEY'] = getenv('TEST_SECRET_KEY')
-        return app
+        return create_app(dict(
+            SQLALCHEMY_DATABASE_URI=str(getenv('FLASK_BOOK_TEST_URI')),
+            SECRET_KEY=getenv('TEST_SECRET_KEY')
+            ))
 
     def setUp(self):
         """Setup the test driver and create test users"""
@@ -58,7 +59,7 @@ class TestRegistration(TestBase):
         self.driver.find_element_by_xpath('//*[@id="submit"]').click()
         time.sleep(1)
 
-        assert url_for('register') in self.driver.current_url
+        assert url_for('main.register') in self.driver.current_url
 
 if __name__ == '__main__':
     unittest.main(port=5000)
\ No newline at end of file